@@ -0,0 +1,93 @@
+import math
+import re
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_MAX_ENTRIES = 512
+DEFAULT_TTL = 6 * 60 * 60
+DEFAULT_THRESHOLD = 0.92
+
+
+def normalize_query(query):
+    return re.sub(r"\s+", " ", query.strip().lower()).rstrip("?.! ")
+
+
+def _cosine(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+class AnswerCache:
+    """
+    Answers already given, shared by every session in the process.
+
+    `scope` identifies the document and retrieval settings. A question
+    asked again verbatim (ignoring case, spacing and trailing punctuation)
+    is served by `get_exact` before any retrieval. A paraphrase is served
+    by `get_similar` once retrieval has picked the same set of pages and
+    the query embeddings are at least `threshold` cosine-similar. Entries
+    expire after `ttl` seconds and the least recently used are dropped
+    beyond `max_entries`.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL, threshold=DEFAULT_THRESHOLD):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expired(self, entry, now=None):
+        return (now or time.time()) - entry["created"] > self.ttl
+
+    def _live(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self._expired(entry):
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def get_exact(self, scope, query):
+        with self._lock:
+            return self._live((scope, normalize_query(query)))
+
+    def get_similar(self, scope, pages, embedding):
+        pages = tuple(sorted(pages))
+        best, best_key, best_score = None, None, self.threshold
+        now = time.time()
+        with self._lock:
+            # Scanning must not touch recency: only the entry served is used
+            for key, entry in list(self._entries.items()):
+                if key[0] != scope:
+                    continue
+                if self._expired(entry, now):
+                    del self._entries[key]
+                    continue
+                if entry["pages"] != pages or entry["embedding"] is None:
+                    continue
+                score = _cosine(embedding, entry["embedding"])
+                if score >= best_score:
+                    best, best_key, best_score = entry, key, score
+            if best_key is not None:
+                self._entries.move_to_end(best_key)
+        return best
+
+    def put(self, scope, query, pages, embedding, answer):
+        entry = {
+            "answer": answer,
+            "pages": tuple(sorted(pages)),
+            "ranked_pages": list(pages),
+            "embedding": list(embedding) if embedding is not None else None,
+            "created": time.time(),
+        }
+        with self._lock:
+            key = (scope, normalize_query(query))
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
@@ -1,10 +1,82 @@
 import streamlit as st
-import os
-import fitz
-import google.generativeai as genai
-from PIL import Image
-import chromadb
-from datetime import datetime
+import time
+from summarizer import DEFAULT_CONCURRENCY, DEFAULT_PAGES_PER_REQUEST
+from index_cache import IndexCache
+from vector_store import DEFAULT_BATCH_SIZE, configure_embedder, embed_query
+from embeddings import DEFAULT_EMBED_BATCH_SIZE, DEFAULT_EMBED_THREADS, DEFAULT_EMBED_DTYPE, DTYPES
+from answer_cache import AnswerCache
+from retrieval import retrieve, rerank, pack_pages, build_contents, stream_text, page_label, DEFAULT_TOP_K, DEFAULT_IMAGE_BUDGET
+from ingest import JobQueue, Worker, run_pipeline, retry_failed, resolve_settings, doc_key_for, credential_id, gemini_model_factory, INDEXING_MODEL
+from scheduler import RequestScheduler, DEFAULT_RPM, DEFAULT_TPM
+from corpus import Corpus
+from telemetry import TRACER
+from pdf_images import thumbnail
+from table_store import lookup_tables, format_facts, fact_ref
+
+# --- PIPELINE SETTINGS ---
+REASONING_MODEL = 'gemini-2.5-flash'
+BACKGROUND_JOBS = 2
+JOB_POLL_SECONDS = 1.0
+
+# Chat history keeps page references only; thumbnails are rendered on demand
+HISTORY_IMAGE_MESSAGES = 20
+THUMBNAIL_CACHE_ENTRIES = 64
+
+# --- SHARED RESOURCES ---
+# Built once per process; heavy clients (Gemini, Chroma, PyMuPDF) load on first use, not on the landing page
+@st.cache_resource
+def get_model_factory(api_key):
+    # Each key gets its own Gemini client, so sessions with different keys never share one
+    return gemini_model_factory(api_key)
+
+@st.cache_resource
+def get_models(api_key):
+    model_factory = get_model_factory(api_key)
+    return model_factory(INDEXING_MODEL), model_factory(REASONING_MODEL)
+
+@st.cache_resource
+def get_answer_cache():
+    return AnswerCache()
+
+@st.cache_resource
+def get_corpus():
+    return Corpus(IndexCache())
+
+@st.cache_resource
+def get_job_queue():
+    return JobQueue()
+
+@st.cache_resource
+def get_scheduler(credential, rpm, tpm):
+    # Quotas are per API key: one scheduler paces indexing, the background worker and chat for each
+    return RequestScheduler(rpm=rpm, tpm=tpm)
+
+@st.cache_resource
+def get_worker():
+    # One in-process worker; `python -m ingest worker` processes can share the same queue
+    return Worker(get_job_queue(), jobs=BACKGROUND_JOBS).start()
+
+def submit_job(pdf_bytes, name, settings, api_key, scheduler):
+    # The job runs with the submitting session's key and scheduler and no other
+    credential = credential_id(api_key)
+    get_worker().add_credential(credential, get_model_factory(api_key), scheduler)
+    return get_job_queue().submit(pdf_bytes, name, settings, credential=credential)
+
+@st.cache_data(max_entries=THUMBNAIL_CACHE_ENTRIES)
+def page_thumbnail(doc_key, page, _store):
+    # At most THUMBNAIL_CACHE_ENTRIES thumbnails are held, whatever the history length
+    return thumbnail(_store.get(page - 1))
+
+def source_store(source):
+    """The page store still holding a history source's page, or None."""
+    corpus = get_corpus()
+    if source["doc_key"] in corpus:
+        store = corpus.pages[source["doc_key"]]
+    elif source["doc_key"] == st.session_state.get('doc_key'):
+        store = st.session_state.get('page_store')
+    else:
+        return None
+    return store if store is not None and source["page"] - 1 in store else None
 
 # --- PAGE CONFIGURATION ---
 st.set_page_config(
@@ -565,13 +637,125 @@ with st.sidebar:
     )
     
     if api_key:
-        genai.configure(api_key=api_key)
-        indexing_model = genai.GenerativeModel('gemini-2.5-flash')
-        reasoning_model = genai.GenerativeModel('gemini-2.5-flash')
+        indexing_model, reasoning_model = get_models(api_key)
         st.markdown('<span class="badge badge-success">✅ Connected</span>', unsafe_allow_html=True)
     else:
         st.markdown('<span class="badge badge-info">⚠️ Not Connected</span>', unsafe_allow_html=True)
     
+    with st.expander("⚡ Indexing Settings"):
+        concurrency = st.slider(
+            "Parallel page requests",
+            min_value=1,
+            max_value=32,
+            value=DEFAULT_CONCURRENCY,
+            help="How many pages are summarized at the same time while indexing"
+        )
+        
+        pages_per_request = st.slider(
+            "Pages per request",
+            min_value=1,
+            max_value=8,
+            value=DEFAULT_PAGES_PER_REQUEST,
+            help="Summarize several pages in one model call; pages the reply misses are retried one by one"
+        )
+        
+        adaptive_render = st.toggle(
+            "Adaptive rendering",
+            value=True,
+            help="Index from small JPEGs and render dense tables & charts sharper for answers"
+        )
+        
+        text_fast_path = st.toggle(
+            "Text page fast path",
+            value=True,
+            help="Index plain prose pages from their text layer instead of a vision model call"
+        )
+        
+        region_retrieval = st.toggle(
+            "Region-level retrieval",
+            value=True,
+            help="Also index charts, tables and text blocks on their own and answer from just the matching crop"
+        )
+        
+        background_indexing = st.toggle(
+            "Background indexing",
+            value=True,
+            help="Index in a worker that keeps going if you close the tab"
+        )
+        
+        batch_size = st.slider(
+            "Vector DB batch size",
+            min_value=1,
+            max_value=256,
+            value=DEFAULT_BATCH_SIZE,
+            help="How many page summaries are embedded and written per database call"
+        )
+    
+    with st.expander("🔎 Retrieval Settings"):
+        top_k = st.slider(
+            "Pages per answer",
+            min_value=1,
+            max_value=8,
+            value=DEFAULT_TOP_K,
+            help="How many of the best-matching pages are sent with each question"
+        )
+        
+        image_budget_mb = st.slider(
+            "Image budget (MB)",
+            min_value=1,
+            max_value=16,
+            value=DEFAULT_IMAGE_BUDGET // 1024 ** 2,
+            help="Maximum page image bytes sent with one question"
+        )
+        
+        table_answers = st.toggle(
+            "Answer lookups from tables",
+            value=True,
+            help="Questions one table cell answers (e.g. revenue in 2023) skip the model"
+        )
+    
+    with st.expander("🚦 Rate Limits"):
+        rpm = st.number_input(
+            "Requests per minute",
+            min_value=1,
+            value=DEFAULT_RPM,
+            help="Gemini request quota shared by indexing and chat"
+        )
+        
+        tpm = st.number_input(
+            "Tokens per minute",
+            min_value=1000,
+            value=DEFAULT_TPM,
+            step=10000,
+            help="Gemini token quota shared by indexing and chat"
+        )
+    scheduler = get_scheduler(credential_id(api_key) if api_key else None, rpm, tpm)
+    
+    with st.expander("🧮 Embeddings"):
+        embed_batch_size = st.slider(
+            "Embedding batch size",
+            min_value=1,
+            max_value=256,
+            value=DEFAULT_EMBED_BATCH_SIZE,
+            help="How many texts the local embedding model encodes per call"
+        )
+        
+        embed_threads = st.slider(
+            "Embedding threads",
+            min_value=1,
+            max_value=8,
+            value=DEFAULT_EMBED_THREADS,
+            help="Batches encoded at the same time; helps on machines with several cores"
+        )
+        
+        embed_dtype = st.selectbox(
+            "Cached vector precision",
+            options=list(DTYPES),
+            index=list(DTYPES).index(DEFAULT_EMBED_DTYPE),
+            help="Storage type of the on-disk embedding cache; float16 and int8 take half and a quarter of the space. Chroma keeps float32 either way"
+        )
+    embedder = configure_embedder(batch_size=embed_batch_size, threads=embed_threads, dtype=embed_dtype)
+    
     st.divider()
     
     # Model Information
@@ -593,11 +777,19 @@ with st.sidebar:
     # Session Info with better layout
     st.markdown("### 📊 Session Stats")
     if 'vector_db' in st.session_state:
-        col1, col2 = st.columns(2)
+        col1, col2, col3 = st.columns(3)
         with col1:
-            st.metric("📄 Pages", st.session_state.vector_db.count())
+            if st.session_state.get('corpus_keys'):
+                pages = get_corpus().page_count(st.session_state.corpus_keys)
+            else:
+                pages = len(st.session_state.page_store)
+            st.metric("📄 Pages", pages)
         with col2:
             st.metric("💬 Queries", st.session_state.get('query_count', 0))
+        with col3:
+            queries = st.session_state.get('query_count', 0)
+            hit_rate = st.session_state.get('cache_hits', 0) / queries if queries else 0
+            st.metric("⚡ Cached", f"{hit_rate:.0%}", help="Share of queries answered from the answer cache")
         
         if st.session_state.get('last_file'):
             st.info(f"📁 **File:** {st.session_state.last_file[:20]}...")
@@ -609,6 +801,29 @@ with st.sidebar:
             </div>
         """, unsafe_allow_html=True)
     
+    # Per-stage timings, bytes and tokens recorded in this process
+    with st.expander("📈 Performance"):
+        perf_rows = TRACER.summary()
+        st.caption(
+            f"🚦 Concurrency limit {scheduler.limit:.1f} · {scheduler.stats['rate_limited']} rate-limited · "
+            f"{scheduler.stats['retries']} retries · {scheduler.stats['wait_s']:.1f}s throttled"
+        )
+        st.caption(
+            f"🧮 {embedder.stats['embedded']} texts embedded in {embedder.stats['batches']} batches · "
+            f"{embedder.stats['hits']} served from the embedding cache"
+        )
+        if perf_rows:
+            st.dataframe(perf_rows, hide_index=True, use_container_width=True)
+            st.download_button(
+                "⬇️ Export JSONL",
+                data=TRACER.to_jsonl(),
+                file_name="pipeline_trace.jsonl",
+                mime="application/jsonl",
+                use_container_width=True
+            )
+        else:
+            st.caption("No pipeline activity recorded yet")
+    
     st.divider()
     
     # Action buttons
@@ -733,34 +948,27 @@ if not api_key:
         """, unsafe_allow_html=True)
 
 else:
-    # --- HELPER FUNCTIONS ---
-    def get_pdf_images(uploaded_file):
-        doc = fitz.open(stream=uploaded_file.read(), filetype="pdf")
-        image_paths = []
-        if not os.path.exists("temp_images"):
-            os.makedirs("temp_images")
-        
-        for i in range(len(doc)):
-            page = doc.load_page(i)
-            pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))
-            path = f"temp_images/page_{i}.png"
-            pix.save(path)
-            image_paths.append(path)
-        return image_paths
-    
     # File upload section with enhanced UI
     st.markdown("### 📤 Upload Your Document")
     
+    corpus_mode = st.toggle(
+        "📚 Corpus mode",
+        help="Upload several PDFs and search across all of them at once"
+    )
+    
     # Create two columns for upload area
     col1, col2 = st.columns([3, 1])
     
     with col1:
-        uploaded_file = st.file_uploader(
+        uploaded = st.file_uploader(
             "Drag and drop or click to browse",
             type="pdf",
+            accept_multiple_files=corpus_mode,
             help="Upload PDFs like financial reports, research papers, or technical documents",
             label_visibility="collapsed"
         )
+    uploaded_file = None if corpus_mode else uploaded
+    uploaded_files = (uploaded or []) if corpus_mode else [uploaded] if uploaded else []
     
     with col2:
         if uploaded_file:
@@ -770,6 +978,13 @@ else:
                     <small>📊 {uploaded_file.size / 1024:.1f} KB</small>
                 </div>
             """, unsafe_allow_html=True)
+        elif uploaded_files:
+            st.markdown(f"""
+                <div class="status-card status-card-success">
+                    <strong>📚 {len(uploaded_files)} files</strong><br>
+                    <small>📊 {sum(f.size for f in uploaded_files) / 1024:.1f} KB</small>
+                </div>
+            """, unsafe_allow_html=True)
         else:
             st.markdown("""
                 <div class="status-card status-card-warning">
@@ -779,8 +994,209 @@ else:
             """, unsafe_allow_html=True)
     
     # Document processing with enhanced progress UI
-    if uploaded_file and api_key:
-        if 'vector_db' not in st.session_state or st.session_state.get('last_file') != uploaded_file.name:
+    if uploaded_files and api_key:
+        index_cache = IndexCache()
+        settings = resolve_settings({
+            "adaptive": adaptive_render,
+            "text_fast_path": text_fast_path,
+            "concurrency": concurrency,
+            "pages_per_request": pages_per_request,
+            "regions": region_retrieval,
+            "batch_size": batch_size,
+            "model": INDEXING_MODEL
+        })
+        cached = None
+        if not corpus_mode:
+            pdf_bytes = uploaded_file.getvalue()
+            doc_key = doc_key_for(pdf_bytes, settings)
+            # A partial index stays in use only until the full one is ready
+            indexed = (
+                'vector_db' in st.session_state and st.session_state.get('doc_key') == doc_key
+                and not st.session_state.get('partial_index')
+            )
+            if not indexed:
+                cached = index_cache.load(doc_key)
+        
+        if corpus_mode:
+            # Every file keeps its own index cache entry; the corpus searches them together
+            corpus = get_corpus()
+            # Evicted documents leave the corpus and are indexed again below
+            corpus.prune()
+            doc_ids, pending = [], []
+            for file in uploaded_files:
+                file_bytes = file.getvalue()
+                key = doc_key_for(file_bytes, settings)
+                doc_ids.append(key)
+                if key in corpus:
+                    continue
+                entry = index_cache.load(key)
+                if entry:
+                    corpus.add(key, file.name, entry)
+                else:
+                    pending.append((file.name, file_bytes, key))
+            
+            if pending and background_indexing:
+                job_queue = get_job_queue()
+                corpus_jobs = st.session_state.setdefault('corpus_jobs', {})
+                jobs = []
+                for name, file_bytes, key in pending:
+                    job = job_queue.get(corpus_jobs[key]) if key in corpus_jobs else None
+                    if job is None or job["status"] == "done":
+                        corpus_jobs[key] = submit_job(file_bytes, name, settings, api_key, scheduler)
+                        job = job_queue.get(corpus_jobs[key])
+                    jobs.append(job)
+                
+                # A failed job stays failed until retried, like the single-document path
+                for (name, file_bytes, key), job in zip(pending, jobs):
+                    if job["status"] == "failed":
+                        st.error(f"❌ Indexing {job['name']} failed: {job['message']}")
+                        if st.button("🔁 Retry Indexing", key=f"retry_{key}"):
+                            del corpus_jobs[key]
+                            st.rerun()
+                active = [job for job in jobs if job["status"] != "failed"]
+                if active:
+                    st.markdown(f"""
+                        <div class="status-card status-card-info loading-pulse">
+                            <h3 style="margin:0;">🔄 Indexing {len(active)} Documents In The Background</h3>
+                            <p style="margin-top:0.5rem; color:#666;">
+                                {len(uploaded_files) - len(pending)} of {len(uploaded_files)} documents are ready. You can close this tab;
+                                indexing carries on and the corpus opens instantly once it is done.
+                            </p>
+                        </div>
+                    """, unsafe_allow_html=True)
+                    st.progress(int(sum(job["progress"] for job in active) / len(active) * 100))
+                    time.sleep(JOB_POLL_SECONDS)
+                    st.rerun()
+            
+            elif pending:
+                with st.status(f"🚀 Indexing {len(pending)} Documents", expanded=True) as status:
+                    progress_bar = st.progress(0)
+                    for n, (name, file_bytes, key) in enumerate(pending):
+                        st.write(f"📄 **{n + 1}/{len(pending)}:** {name}")
+                        result = run_pipeline(
+                            file_bytes,
+                            indexing_model,
+                            settings,
+                            cache=index_cache,
+                            on_progress=lambda fraction, n=n: progress_bar.progress(int((n + fraction) / len(pending) * 100)),
+                            on_page_error=lambda idx, e, name=name: st.warning(f"⚠️ {name} page {idx + 1} could not be summarized ({str(e)}); queued for retry"),
+                            scheduler=scheduler
+                        )
+                        corpus.add(key, name, result)
+                    status.update(label="✅ Corpus Ready!", state="complete", expanded=False)
+            
+            doc_ids = [key for key in dict.fromkeys(doc_ids) if key in corpus]
+            if not doc_ids:
+                st.stop()
+            if st.session_state.get('corpus_keys') != doc_ids:
+                st.session_state.corpus_keys = doc_ids
+                st.session_state.vector_db = corpus.collection
+                st.session_state.doc_key = None
+                st.session_state.last_file = f"{len(doc_ids)} documents"
+                st.session_state.query_count = 0
+                st.session_state.cache_hits = 0
+            
+            st.markdown(f"""
+                <div class="status-card status-card-success">
+                    <h3 style="margin:0;">📚 Corpus Ready</h3>
+                    <p style="margin-top:0.5rem; color:#666;">
+                        <strong>{len(doc_ids)} documents</strong> with <strong>{corpus.page_count(doc_ids)} pages</strong> are searchable together.
+                    </p>
+                </div>
+            """, unsafe_allow_html=True)
+            search_ids = st.multiselect(
+                "🗂️ Search in",
+                options=doc_ids,
+                default=doc_ids,
+                format_func=lambda key: corpus.names[key],
+                help="Retrieval is pre-filtered to the selected documents"
+            )
+            if not search_ids:
+                st.warning("⚠️ Select at least one document to search")
+                st.stop()
+        
+        elif cached:
+            # Already indexed: reuse the stored summaries, images and collection
+            page_store = cached["pages"]
+            st.session_state.lexical_index = cached["lexical"]
+            st.session_state.table_store = cached["tables"]
+            st.session_state.vector_db = cached["collection"]
+            st.session_state.doc_key = doc_key
+            st.session_state.last_file = uploaded_file.name
+            st.session_state.query_count = 0
+            st.session_state.cache_hits = 0
+            st.session_state.page_store = page_store
+            st.session_state.failed_pages = cached["failed"]
+            st.session_state.partial_index = False
+            st.session_state.pop('corpus_keys', None)
+            st.markdown(f"""
+                <div class="status-card status-card-success">
+                    <h3 style="margin:0;">⚡ Loaded From Cache</h3>
+                    <p style="margin-top:0.5rem; color:#666;">
+                        <strong>{uploaded_file.name}</strong> is indexed, so its <strong>{len(page_store)} pages</strong> are ready instantly.
+                    </p>
+                </div>
+            """, unsafe_allow_html=True)
+        
+        elif not indexed and background_indexing:
+            # Hand the document to the worker and poll; closing the tab does not stop it
+            job_queue = get_job_queue()
+            # Submitted once per document; a failed job is shown, not silently replaced
+            index_jobs = st.session_state.setdefault('index_jobs', {})
+            job = job_queue.get(index_jobs[doc_key]) if doc_key in index_jobs else None
+            if job is None or job["status"] == "done":
+                index_jobs[doc_key] = submit_job(pdf_bytes, uploaded_file.name, settings, api_key, scheduler)
+                job = job_queue.get(index_jobs[doc_key])
+            job_id = job["id"]
+            
+            if job["status"] == "failed":
+                st.error(f"❌ Indexing failed: {job['message']}")
+                if st.button("🔁 Retry Indexing"):
+                    del index_jobs[doc_key]
+                    st.rerun()
+                st.stop()
+            
+            # The worker checkpoints as it goes; pages indexed so far can be searched right away
+            partial = index_cache.load(doc_key, partial=True)
+            searchable = sum(s is not None for s in partial["summaries"]) if partial else 0
+            
+            st.markdown(f"""
+                <div class="status-card status-card-info loading-pulse">
+                    <h3 style="margin:0;">🔄 Indexing In The Background</h3>
+                    <p style="margin-top:0.5rem; color:#666;">
+                        Job #{job_id} is <strong>{job['status']}</strong>. You can close this tab; indexing carries on and
+                        the document opens instantly once it is done.
+                    </p>
+                </div>
+            """, unsafe_allow_html=True)
+            
+            if not searchable:
+                st.progress(int(job["progress"] * 100))
+                time.sleep(JOB_POLL_SECONDS)
+                st.rerun()
+            
+            page_store = partial["pages"]
+            st.session_state.vector_db = partial["collection"]
+            st.session_state.lexical_index = partial["lexical"]
+            st.session_state.table_store = partial["tables"]
+            st.session_state.page_store = page_store
+            st.session_state.failed_pages = []
+            st.session_state.doc_key = doc_key
+            st.session_state.last_file = uploaded_file.name
+            st.session_state.partial_index = True
+            st.session_state.pop('corpus_keys', None)
+            st.info(f"⚡ {searchable} of {len(partial['summaries'])} pages are already searchable; answers cover those pages only")
+            
+            @st.fragment(run_every=JOB_POLL_SECONDS)
+            def job_progress():
+                job = get_job_queue().get(job_id)
+                if job["status"] not in ("queued", "running"):
+                    st.rerun()
+                st.progress(int(job["progress"] * 100))
+            
+            job_progress()
+        
+        elif not indexed:
             
             # Processing animation
             st.markdown("""
@@ -791,49 +1207,48 @@ else:
             """, unsafe_allow_html=True)
             
             with st.status("🚀 Processing Pipeline Active", expanded=True) as status:
-                # Step 1
+                # Steps overlap: pages are summarized as soon as they are rendered and embedded as summaries land
                 st.write("📄 **Step 1/3:** Converting PDF pages to high-quality images...")
-                progress_bar = st.progress(0)
-                img_paths = get_pdf_images(uploaded_file)
-                progress_bar.progress(33)
-                st.success(f"✅ Converted {len(img_paths)} pages successfully!")
-                
-                # Step 2
                 st.write("🤖 **Step 2/3:** AI is analyzing each page and generating summaries...")
-                summaries = []
-                for idx, path in enumerate(img_paths):
-                    try:
-                        img = Image.open(path)
-                        res = indexing_model.generate_content([
-                            "Summarize this page accurately for search.",
-                            img
-                        ])
-                        summaries.append(res.text)
-                        progress_bar.progress(33 + int((idx + 1) / len(img_paths) * 34))
-                    except Exception as e:
-                        st.error(f"Error processing page {idx + 1}: {str(e)}")
-                        summaries.append(f"Page {idx + 1} - Processing error")
-                st.success(f"✅ Generated {len(summaries)} AI summaries!")
-                
-                # Step 3
                 st.write("💾 **Step 3/3:** Building searchable vector database...")
-                client = chromadb.Client()
-                collection = client.create_collection(
-                    name=f"col_{uploaded_file.name[:5]}_{int(datetime.now().timestamp())}"
+                progress_bar = st.progress(0)
+                
+                result = run_pipeline(
+                    pdf_bytes,
+                    indexing_model,
+                    settings,
+                    cache=index_cache,
+                    on_progress=lambda fraction: progress_bar.progress(int(fraction * 95)),
+                    on_page_error=lambda idx, e: st.warning(f"⚠️ Page {idx + 1} could not be summarized ({str(e)}); queued for retry"),
+                    scheduler=scheduler
                 )
-                for i, s in enumerate(summaries):
-                    collection.add(
-                        documents=[s],
-                        metadatas=[{"path": img_paths[i], "page": i+1}],
-                        ids=[str(i)]
-                    )
+                stats = result["stats"]
+                page_store = result["pages"]
                 progress_bar.progress(100)
+                
+                st.success(f"✅ Converted {stats['pages']} pages successfully!")
+                st.success(f"✅ Generated {stats['pages'] - stats['errors']} AI summaries!")
+                st.info(f"♻️ Summary cache: {stats['cache_hits']} hits, {stats['cache_misses']} misses")
+                if stats["text_pages"]:
+                    st.info(f"📝 {stats['text_pages']} text-native pages indexed from their text layer ({stats['text_pages']} model calls avoided)")
+                if stats["uploaded_pages"]:
+                    st.info(
+                        f"📦 Uploaded {stats['index_bytes'] / 1024:.0f} KB for {stats['uploaded_pages']} pages "
+                        f"(full-size images: {stats['index_full_bytes'] / 1024:.0f} KB)"
+                    )
                 st.success("✅ Vector database created and optimized!")
                 
-                st.session_state.vector_db = collection
+                st.session_state.vector_db = result["collection"]
+                st.session_state.doc_key = doc_key
                 st.session_state.last_file = uploaded_file.name
                 st.session_state.query_count = 0
-                st.session_state.img_paths = img_paths
+                st.session_state.cache_hits = 0
+                st.session_state.page_store = page_store
+                st.session_state.lexical_index = result["lexical"]
+                st.session_state.table_store = result["tables"]
+                st.session_state.failed_pages = result["failed"]
+                st.session_state.partial_index = False
+                st.session_state.pop('corpus_keys', None)
                 
                 status.update(label="✅ Processing Complete!", state="complete", expanded=False)
             
@@ -843,7 +1258,7 @@ else:
                 <div class="status-card status-card-success">
                     <h3 style="margin:0;">🎉 Document Ready for Analysis!</h3>
                     <p style="margin-top:0.5rem; color:#666;">
-                        Successfully indexed <strong>{len(img_paths)} pages</strong> from <strong>{uploaded_file.name}</strong>
+                        Successfully indexed <strong>{len(page_store)} pages</strong> from <strong>{uploaded_file.name}</strong>
                     </p>
                     <p style="margin-top:0.5rem; font-size:0.9rem; color:#28a745;">
                         💬 You can now ask questions below!
@@ -851,6 +1266,21 @@ else:
                 </div>
             """, unsafe_allow_html=True)
         
+        # Pages that failed every retry are left out of search until they are summarized
+        if not corpus_mode and st.session_state.get('failed_pages'):
+            failed_pages = st.session_state.failed_pages
+            st.warning(
+                f"⚠️ {len(failed_pages)} pages could not be summarized yet and are left out of search "
+                f"(pages {', '.join(str(idx + 1) for idx in failed_pages[:10])}{'...' if len(failed_pages) > 10 else ''})"
+            )
+            if st.button("🔁 Retry failed pages"):
+                with st.spinner("Summarizing failed pages..."):
+                    st.session_state.failed_pages = retry_failed(
+                        st.session_state.doc_key, indexing_model, cache=index_cache, settings=settings, scheduler=scheduler
+                    )
+                    st.session_state.lexical_index = index_cache.load(st.session_state.doc_key)["lexical"]
+                st.rerun()
+        
         st.divider()
         
         # --- CHAT INTERFACE ---
@@ -860,16 +1290,23 @@ else:
         if "messages" not in st.session_state:
             st.session_state.messages = []
         
-        # Display chat history
-        for message in st.session_state.messages:
+        # Display chat history; only the latest messages show their source pages
+        image_from = len(st.session_state.messages) - HISTORY_IMAGE_MESSAGES
+        for n, message in enumerate(st.session_state.messages):
             with st.chat_message(message["role"]):
                 st.write(message["content"])
-                if "image" in message and "page" in message:
-                    with st.expander(f"📄 View Source - Page {message['page']}", expanded=False):
-                        st.image(message["image"], use_container_width=True)
+                for source in message.get("sources", []):
+                    with st.expander(f"📄 View Source - {source['label']}", expanded=False):
+                        store = source_store(source) if n >= image_from else None
+                        if store is not None:
+                            st.image(page_thumbnail(source["doc_key"], source["page"], store), use_container_width=True)
+                        else:
+                            st.caption(f"📍 Reference: {source['label']}")
         
         # Chat input
         query = st.chat_input("💭 Ask about charts, tables, or specific data in the document...")
+        if not query:
+            query = st.session_state.pop('example_query', None)
         
         if query:
             # Update query count
@@ -883,37 +1320,95 @@ else:
             
             # Display assistant response
             with st.chat_message("assistant"):
-                with st.spinner("🔍 Searching document and analyzing..."):
-                    try:
-                        # Retrieval
-                        results = st.session_state.vector_db.query(query_texts=[query], n_results=1)
-                        best_page_path = results['metadatas'][0][0]['path']
-                        page_num = results['metadatas'][0][0]['page']
-                        
-                        # Generation
-                        img_to_analyze = Image.open(best_page_path)
-                        prompt = f"Using the provided document image, answer this question in detail: {query}\n\nProvide specific information, numbers, and insights from the image."
-                        response = reasoning_model.generate_content([prompt, img_to_analyze])
-                        
-                        # Display result
-                        st.write(response.text)
-                        
-                        # Reference section
-                        with st.expander(f"📄 View Source - Page {page_num}", expanded=False):
-                            st.image(img_to_analyze, use_container_width=True)
-                            st.caption(f"📍 Reference: Page {page_num} of {uploaded_file.name}")
-                        
-                        # Save to history
-                        st.session_state.messages.append({
-                            "role": "assistant",
-                            "content": response.text,
-                            "image": img_to_analyze,
-                            "page": page_num
+                try:
+                    answer_cache = get_answer_cache()
+                    if corpus_mode:
+                        page_store, names = corpus.pages, corpus.names
+                        tables = {doc_id: corpus.tables[doc_id] for doc_id in search_ids if doc_id in corpus.tables}
+                        cache_scope = (tuple(sorted(search_ids)), REASONING_MODEL, top_k, image_budget_mb)
+                    else:
+                        page_store, names = st.session_state.page_store, {}
+                        tables = st.session_state.get('table_store')
+                        cache_scope = (st.session_state.doc_key, REASONING_MODEL, top_k, image_budget_mb)
+                    
+                    # A question one table cell answers needs no retrieval or model call
+                    facts = lookup_tables(query, tables) if table_answers and tables is not None else []
+                    if facts:
+                        cached = {
+                            "answer": format_facts(facts, names),
+                            "ranked_pages": list(dict.fromkeys(fact_ref(fact) for fact in facts))
+                        }
+                    else:
+                        # Exact repeats skip retrieval and generation entirely
+                        cached = answer_cache.get_exact(cache_scope, query)
+                    if cached is None:
+                        with st.spinner("🔍 Searching document and analyzing..."):
+                            # Retrieval: vector candidates, reranked locally, packed under the image budget
+                            embedding = embed_query(query)
+                            if corpus_mode:
+                                hits = corpus.search(query, doc_ids=search_ids, top_k=top_k, embedding=embedding)
+                            else:
+                                hits = rerank(
+                                    query,
+                                    retrieve(st.session_state.vector_db, query, embedding=embedding),
+                                    top_k=top_k,
+                                    lexical=st.session_state.lexical_index
+                                )
+                            packed = pack_pages(hits, page_store, budget=image_budget_mb * 1024 ** 2)
+                            page_nums = [page_ref for page_ref, _ in packed]
+                            
+                            # Paraphrases of an earlier question about the same pages reuse its answer
+                            cached = answer_cache.get_similar(cache_scope, page_nums, embedding)
+                            if cached is None:
+                                # Generation: one multi-image call for every selected page, streamed back
+                                response = scheduler.generate(reasoning_model, build_contents(query, packed, names), "reason", stream=True)
+                    
+                    if cached is not None:
+                        answer = cached["answer"]
+                        page_nums = cached["ranked_pages"]
+                        st.write(answer)
+                        if facts:
+                            st.caption("📊 Answered from the tables extracted while indexing")
+                        else:
+                            st.caption("⚡ Served from the answer cache")
+                            st.session_state.cache_hits = st.session_state.get('cache_hits', 0) + 1
+                    else:
+                        # Display result token by token as it arrives
+                        answer = st.write_stream(stream_text(response))
+                        if corpus_mode or not st.session_state.get('partial_index'):
+                            answer_cache.put(cache_scope, query, page_nums, embedding, answer)
+                    
+                    # Reference section; history keeps only these references, not the images
+                    sources = []
+                    for page_ref in page_nums:
+                        # Corpus pages are referenced as (doc_id, page)
+                        doc_id, page_num = page_ref if isinstance(page_ref, tuple) else (None, page_ref)
+                        sources.append({
+                            "doc_key": doc_id or st.session_state.doc_key,
+                            "page": page_num,
+                            "label": page_label(page_ref, names)
                         })
+                    for source in sources:
+                        store = page_store[source["doc_key"]] if corpus_mode else page_store
+                        with st.expander(f"📄 View Source - {source['label']}", expanded=False):
+                            st.image(store.get(source["page"] - 1), use_container_width=True)
+                            if uploaded_file:
+                                st.caption(f"📍 Reference: Page {source['page']} of {uploaded_file.name}")
+                            else:
+                                st.caption(f"📍 Reference: {source['label']}")
+                    if cached is None:
+                        st.caption(f"📦 Sent {sum(len(part['data']) for _, part in packed) / 1024:.0f} KB of page images")
                     
-                    except Exception as e:
-                        st.error(f"❌ Error processing query: {str(e)}")
-                        st.info("💡 Try rephrasing your question or check your API key.")
+                    # Save to history
+                    st.session_state.messages.append({
+                        "role": "assistant",
+                        "content": answer,
+                        "sources": sources
+                    })
+                
+                except Exception as e:
+                    st.error(f"❌ Error processing query: {str(e)}")
+                    st.info("💡 Try rephrasing your question or check your API key.")
         
         # Example queries section
         if len(st.session_state.messages) == 0:
@@ -953,12 +1448,6 @@ else:
                 if st.button("💰 Financial data", use_container_width=True):
                     st.session_state.example_query = "What financial data or monetary figures are mentioned?"
                     st.rerun()
-        
-        # Handle example query
-        if 'example_query' in st.session_state:
-            query = st.session_state.example_query
-            del st.session_state.example_query
-            st.rerun()
 
 # --- FOOTER ---
 st.divider()
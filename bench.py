@@ -0,0 +1,744 @@
+"""
+Offline benchmarks for the indexing and query pipeline.
+
+    python bench.py pipeline --pages 10 100 1000
+    python bench.py writes --pages 10 100 1000
+    python bench.py corpus --pages 1000 10000 100000
+    python bench.py chat --messages 200
+    python bench.py startup
+    python bench.py embed --model hash
+
+Everything runs offline: Gemini is replaced by `FakeModel` and the
+pipeline benchmark embeds with a local hashing function, so no API key or
+model download is needed. `embed` times Chroma's local ONNX model, or
+the hashing function with `--model hash`. `startup` drives the Streamlit
+app itself through `streamlit.testing` and exits non-zero when it misses
+its budget.
+"""
+import argparse
+import hashlib
+import heapq
+import json
+import multiprocessing
+import os
+import random
+import re
+import statistics
+import tempfile
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from embeddings import DTYPES, LocalEmbedding, quantize
+
+from fake_gemini import FakeModel
+from retrieval import (
+    BM25Index, CorpusIndex, build_contents, doc_filter, pack_pages, rerank, retrieve, retrieve_many, stream_text
+)
+from summarizer import summarize_stream
+from telemetry import TRACER, generate
+from vector_store import BatchWriter, VectorStore, DEFAULT_BATCH_SIZE
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+WORDS = (
+    "revenue growth margin quarter fiscal chart table segment operating cash "
+    "flow guidance forecast region product customer churn pipeline headcount "
+    "expense capital dividend share earnings outlook risk compliance audit"
+).split()
+
+
+def synthetic_summaries(n, seed=0):
+    rng = random.Random(seed)
+    return [
+        f"Page {i + 1}: " + " ".join(rng.choice(WORDS) for _ in range(80))
+        for i in range(n)
+    ]
+
+
+def synthetic_corpus_text(n, vocabulary=20000, seed=0):
+    # Zipf-distributed vocabulary, so most terms are rare the way real filings' are
+    rng = random.Random(seed)
+    words = WORDS + [f"term{i}" for i in range(vocabulary)]
+    weights = [1 / (rank + 1) for rank in range(len(words))]
+    return [
+        f"Page {i + 1}: " + " ".join(rng.choices(words, weights, k=80))
+        for i in range(n)
+    ]
+
+
+def synthetic_pdf(pages, seed=0):
+    """
+    A report-like PDF cycling through prose, table and bar-chart pages, so
+    the text fast path, adaptive rendering and the vision path all get
+    exercised. Built with PyMuPDF (already a dependency) rather than
+    reportlab.
+    """
+    import fitz
+
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for i in range(pages):
+        page = doc.new_page(width=595, height=842)
+        page.insert_text((72, 72), f"Synthetic Annual Report - Page {i + 1}", fontsize=18)
+        kind = i % 3
+        if kind == 0:
+            prose = " ".join(rng.choice(WORDS) for _ in range(350))
+            page.insert_textbox(fitz.Rect(72, 100, 523, 770), prose, fontsize=11)
+        elif kind == 1:
+            # A ruled table with a header row, the kind `find_tables` picks up
+            columns = (72, 220, 380, 523)
+            rows = [("Year", "Revenue", "Growth")] + [
+                (str(year), f"${rng.uniform(1, 9):.1f}M", f"{rng.uniform(-10, 40):+.0f}%")
+                for year in range(2015, 2025)
+            ]
+            y = 120
+            page.draw_line((72, y - 20), (523, y - 20))
+            for row in rows:
+                for x, cell in zip(columns, row):
+                    page.insert_text((x + 6, y), cell, fontsize=12)
+                page.draw_line((72, y + 8), (523, y + 8))
+                y += 28
+            for x in columns:
+                page.draw_line((x, 100), (x, y - 20))
+        else:
+            # Commentary above the chart, so the page has two regions to tell apart
+            commentary = " ".join(rng.choice(WORDS) for _ in range(60))
+            page.insert_textbox(fitz.Rect(72, 100, 523, 220), commentary, fontsize=11)
+            for bar in range(12):
+                height = rng.uniform(40, 400)
+                x = 80 + bar * 36
+                page.draw_rect(fitz.Rect(x, 700 - height, x + 24, 700), color=(0, 0, 0), fill=(0.2, 0.4, 0.8))
+                page.insert_text((x, 718), f"Q{bar % 4 + 1}", fontsize=9)
+    return doc.tobytes()
+
+
+class HashEmbedding:
+    """Offline Chroma embedding function: hashed bag of words, L2-normalized."""
+
+    def __init__(self, dim=384):
+        self.dim = dim
+
+    def __call__(self, input):
+        return [self.embed(text) for text in input]
+
+    # Chroma >= 1.0 asks embedding functions to describe themselves
+    @staticmethod
+    def name():
+        return "bench_hash"
+
+    def get_config(self):
+        return {"dim": self.dim}
+
+    @staticmethod
+    def build_from_config(config):
+        return HashEmbedding(config.get("dim", 384))
+
+    def embed(self, text):
+        vector = [0.0] * self.dim
+        for word in re.findall(r"[a-z0-9]+", text.lower()):
+            bucket = int.from_bytes(hashlib.md5(word.encode()).digest()[:4], "big")
+            vector[bucket % self.dim] += 1.0
+        norm = sum(x * x for x in vector) ** 0.5 or 1.0
+        return [x / norm for x in vector]
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process and of its finished children."""
+    if resource is None:
+        return 0.0, 0.0
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    scale = 1024 ** 2 if os.uname().sysname == "Darwin" else 1024
+    return (
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale,
+    )
+
+
+def rss_mb():
+    """Current resident memory of this process (Linux; peak elsewhere)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+    except (OSError, ValueError, AttributeError):
+        return peak_rss_mb()[0]
+
+
+def fresh_collection():
+    import chromadb
+
+    # HashEmbedding keeps the write timings offline and free of model cost
+    return chromadb.Client().create_collection(
+        f"bench_{uuid.uuid4().hex[:8]}", embedding_function=HashEmbedding()
+    )
+
+
+def percentiles(samples, scale=1000):
+    """(p50, p95) of `samples`, by default seconds in milliseconds."""
+    ordered = sorted(samples)
+    return (
+        statistics.median(ordered) * scale,
+        ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * scale,
+    )
+
+
+def print_table(title, headers, rows):
+    print(f"\n{title}")
+    print(" | ".join(f"{h:>14}" for h in headers))
+    for row in rows:
+        print(" | ".join(f"{c:>14.3f}" if isinstance(c, float) else f"{c:>14}" for c in row))
+
+
+# --- BULK WRITES ---
+def bench_writes(args):
+    rows = []
+    for n in args.pages:
+        summaries = synthetic_summaries(n)
+
+        collection = fresh_collection()
+        start = time.perf_counter()
+        for i, s in enumerate(summaries):
+            collection.add(documents=[s], metadatas=[{"page": i + 1}], ids=[str(i)])
+        per_page = time.perf_counter() - start
+
+        collection = fresh_collection()
+        start = time.perf_counter()
+        writer = BatchWriter(collection, batch_size=args.batch_size, background=False)
+        for i, s in enumerate(summaries):
+            writer.add(i, s, {"page": i + 1})
+        writer.close()
+        batched = time.perf_counter() - start
+
+        # Summarize with a fake model, embedding either after the fact or as pages settle
+        model = FakeModel(latency=args.latency)
+        items = [(i, i, None) for i in range(n)]
+
+        collection = fresh_collection()
+        start = time.perf_counter()
+        done, _, _ = summarize_stream(model, items, concurrency=args.concurrency)
+        writer = BatchWriter(collection, batch_size=args.batch_size, background=False)
+        for i, s in enumerate(done):
+            writer.add(i, s, {"page": i + 1})
+        writer.close()
+        sequential = time.perf_counter() - start
+
+        collection = fresh_collection()
+        start = time.perf_counter()
+        writer = BatchWriter(collection, batch_size=args.batch_size)
+        summarize_stream(
+            model, items, concurrency=args.concurrency,
+            on_page=lambda i, s, e: writer.add(i, s, {"page": i + 1})
+        )
+        writer.close()
+        pipelined = time.perf_counter() - start
+
+        rows.append((n, per_page, batched, sequential, pipelined))
+
+    print_table(
+        f"Chroma writes (seconds, batch={args.batch_size}, fake latency={args.latency}s)",
+        ["pages", "per-page add", "batched add", "summ+embed", "pipelined"],
+        rows
+    )
+
+
+# --- CORPUS SCALING ---
+def random_embedding(rng, dim):
+    vector = [rng.gauss(0, 1) for _ in range(dim)]
+    norm = sum(x * x for x in vector) ** 0.5
+    return [x / norm for x in vector]
+
+
+def bench_corpus(args):
+    """
+    Query latency of a corpus collection as it grows. Embeddings are random
+    unit vectors of the default model's size, so building a 100k-page corpus
+    does not wait on the embedding model; queries reuse one precomputed
+    embedding the way the app does. Narrowed scopes are timed both ways
+    `Corpus.search` can run them: a `doc_id` filter on the corpus
+    collection, and the documents' own collections merged.
+    """
+    import chromadb
+
+    rng = random.Random(0)
+    client = chromadb.Client()
+    queries = ["operating margin term120", "quarterly term4031 guidance", "dividend term77 risk"]
+    rows = []
+    for n in args.pages:
+        collection = client.create_collection(f"bench_{uuid.uuid4().hex[:8]}", metadata={"hnsw:space": "cosine"})
+        lexical = CorpusIndex()
+        docs = [f"doc{d:05d}" for d in range((n + args.doc_pages - 1) // args.doc_pages)]
+        summaries = synthetic_corpus_text(n)
+        # The first 10 documents also get their own collection, as in the index cache
+        own = {
+            doc_id: client.create_collection(f"bench_{uuid.uuid4().hex[:8]}", metadata={"hnsw:space": "cosine"})
+            for doc_id in docs[:10]
+        }
+        batch_size = getattr(client, "get_max_batch_size", lambda: 5000)()
+        for start in range(0, n, batch_size):
+            end = min(n, start + batch_size)
+            embeddings = [random_embedding(rng, args.dim) for _ in range(start, end)]
+            collection.add(
+                ids=[str(i) for i in range(start, end)],
+                embeddings=embeddings,
+                documents=summaries[start:end],
+                metadatas=[
+                    {"page": i % args.doc_pages + 1, "doc_id": docs[i // args.doc_pages]}
+                    for i in range(start, end)
+                ]
+            )
+            for i in range(start, min(end, len(own) * args.doc_pages)):
+                own[docs[i // args.doc_pages]].add(
+                    ids=[str(i)], embeddings=[embeddings[i - start]], documents=[summaries[i]],
+                    metadatas=[{"page": i % args.doc_pages + 1}]
+                )
+        for d, doc_id in enumerate(docs):
+            index = BM25Index()
+            for i in range(d * args.doc_pages, min(n, (d + 1) * args.doc_pages)):
+                index.add(i % args.doc_pages + 1, summaries[i])
+            lexical.add(doc_id, index)
+
+        embedding = random_embedding(rng, args.dim)
+        def filtered(selected):
+            where = doc_filter(selected)
+            return lambda query: retrieve(collection, query, embedding=embedding, where=where)
+
+        def per_document(selected):
+            collections = {doc_id: own[doc_id] for doc_id in selected}
+            return lambda query: retrieve_many(collections, query, embedding=embedding)
+
+        scopes = [("all", lambda query: retrieve(collection, query, embedding=embedding), lexical)]
+        for count in (1, 10):
+            selected = docs[:count]
+            label = f"{count} doc{'s' if count > 1 else ''}"
+            scopes += [
+                (f"{label} filter", filtered(selected), lexical.restrict(selected)),
+                (f"{label} own", per_document(selected), lexical.restrict(selected)),
+            ]
+        for label, search, index in scopes:
+            vector, bm25, total = [], [], []
+            for r in range(args.repeats):
+                query = queries[r % len(queries)]
+                start = time.perf_counter()
+                hits = search(query)
+                middle = time.perf_counter()
+                rerank(query, hits, lexical=index)
+                end = time.perf_counter()
+                vector.append(middle - start)
+                bm25.append(end - middle)
+                total.append(end - start)
+            rows.append((n, label) + percentiles(vector) + percentiles(bm25) + percentiles(total))
+        for c in [collection, *own.values()]:
+            client.delete_collection(c.name)
+
+    print_table(
+        f"Corpus retrieval (ms, {args.doc_pages} pages/doc, {args.repeats} queries)",
+        ["pages", "scope", "vector p50", "vector p95", "rerank p50", "rerank p95", "total p50", "total p95"],
+        rows
+    )
+
+
+# --- END-TO-END PIPELINE ---
+QUERIES = [
+    "What was the revenue in 2019?",
+    "Which quarter had the tallest bar in the chart?",
+    "Summarize the operating margin and cash flow discussion.",
+    "What growth percentage is shown for 2023?",
+    "What risks and compliance issues are mentioned?",
+]
+
+
+def _run_pipeline(pages, options):
+    # Runs in its own process so peak memory is measured per document size
+    from ingest import run_pipeline
+    from index_cache import IndexCache
+
+    pdf_bytes = synthetic_pdf(pages, seed=options["seed"])
+    model = FakeModel(
+        latency=options["latency"], failure_rate=options["failure_rate"],
+        summary_words=60, chunk_latency=0.0, seed=options["seed"], bad_batch_rate=options["bad_batch_rate"]
+    )
+    # Failures only apply to indexing, where they are retried
+    reasoner = FakeModel(latency=options["latency"], chunk_latency=0.0)
+    embedder = HashEmbedding()
+    with tempfile.TemporaryDirectory() as root:
+        cache = IndexCache(root, vectors=VectorStore(os.path.join(root, "chroma"), embedding_function=embedder))
+        start = time.perf_counter()
+        settings = {
+            "concurrency": options["concurrency"],
+            "pages_per_request": options["pages_per_request"],
+            "regions": options["regions"],
+        }
+        result = run_pipeline(pdf_bytes, model, settings, cache=cache)
+        ingest_seconds = time.perf_counter() - start
+
+        retrieval, total, lookups, table_hits = [], [], [], 0
+        image_kb, crops = [], 0
+        for q in range(options["queries"]):
+            query = QUERIES[q % len(QUERIES)]
+            start = time.perf_counter()
+            table_hits += bool(result["tables"].lookup(query))
+            lookups.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            hits = rerank(
+                query,
+                retrieve(result["collection"], query, embedding=embedder.embed(query)),
+                lexical=result["lexical"]
+            )
+            packed = pack_pages(hits, result["pages"])
+            image_kb.append(sum(len(part["data"]) for _, part in packed) / 1024)
+            crops += sum("region" in hit for hit in hits[:len(packed)])
+            middle = time.perf_counter()
+            "".join(stream_text(generate(reasoner, build_contents(query, packed), "reason", stream=True)))
+            end = time.perf_counter()
+            retrieval.append(middle - start)
+            total.append(end - start)
+        result["pages"].close()
+
+    rss, children = peak_rss_mb()
+    stats = result["stats"]
+    return {
+        "pages": pages,
+        "ingest_s": ingest_seconds,
+        "pages_per_s": pages / ingest_seconds,
+        "model_calls": model.calls,
+        "errors": stats["errors"],
+        "table_facts": stats["table_facts"],
+        "table_hits": table_hits,
+        "regions": stats["regions"],
+        "crops": crops,
+        "image_kb": percentiles(image_kb, scale=1),
+        "lookup": percentiles(lookups),
+        "retrieval": percentiles(retrieval),
+        "query": percentiles(total),
+        "rss_mb": rss,
+        "render_rss_mb": children,
+        "spans": TRACER.spans(),
+    }
+
+
+def bench_pipeline(args):
+    """
+    Ingestion throughput, query latency and peak memory on synthetic PDFs,
+    end to end through `ingest.run_pipeline` with a fake model. Each size
+    runs in a fresh process.
+    """
+    options = {
+        "latency": args.latency,
+        "failure_rate": args.failure_rate,
+        "concurrency": args.concurrency,
+        "pages_per_request": args.pages_per_request,
+        "bad_batch_rate": args.bad_batch_rate,
+        "regions": not args.no_regions,
+        "queries": args.queries,
+        "seed": args.seed,
+    }
+    rows, table_rows, image_rows = [], [], []
+    for n in args.pages:
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            run = pool.submit(_run_pipeline, n, options).result()
+        rows.append((
+            n, run["ingest_s"], run["pages_per_s"], run["model_calls"], run["errors"],
+            *run["retrieval"], *run["query"], run["rss_mb"], run["render_rss_mb"]
+        ))
+        table_rows.append((n, run["table_facts"], f"{run['table_hits']}/{args.queries}", *run["lookup"]))
+        image_rows.append((n, run["regions"], run["crops"], *run["image_kb"]))
+        for span in run["spans"]:
+            TRACER.add({**span, "bench_pages": n})
+
+    print_table(
+        f"Pipeline (fake latency={args.latency}s, failure rate={args.failure_rate}, "
+        f"concurrency={args.concurrency}, pages/request={args.pages_per_request}, {args.queries} queries)",
+        ["pages", "ingest s", "pages/s", "model calls", "failed pages",
+         "retrieve p50", "retrieve p95", "query p50", "query p95", "peak MB", "render MB"],
+        rows
+    )
+    print_table(
+        "Table lookups (questions answered without retrieval or a model call)",
+        ["pages", "table facts", "answered", "lookup p50", "lookup p95"],
+        table_rows
+    )
+    print_table(
+        f"Answer images (regions {'off' if args.no_regions else 'on'}; KB of images sent per question)",
+        ["pages", "regions indexed", "crops sent", "KB p50", "KB p95"],
+        image_rows
+    )
+    print_table(
+        "Stages (all sizes)",
+        ["stage", "calls", "errors", "total s", "p50 ms", "p95 ms", "bytes", "tokens"],
+        [tuple(row.values()) for row in TRACER.summary()]
+    )
+    if args.trace:
+        TRACER.export(args.trace)
+
+
+def _run_chat(mode, options):
+    # Runs in its own process so each history layout's memory is measured alone
+    import functools
+    import fitz
+    from page_store import PageStore
+    from pdf_images import get_pdf_images, thumbnail
+
+    store = PageStore()
+    for idx, variants, *_ in get_pdf_images(synthetic_pdf(options["pages"], seed=options["seed"]), workers=1):
+        store.put(idx, *variants["answer"])
+    baseline = rss_mb()
+
+    @functools.lru_cache(maxsize=options["cache_entries"])
+    def cached_thumbnail(page):
+        return thumbnail(store.get(page - 1))
+
+    rng = random.Random(options["seed"])
+    messages = []
+    for _ in range(options["messages"] // 2):
+        messages.append({"role": "user", "content": rng.choice(QUERIES)})
+        pages = rng.sample(range(1, options["pages"] + 1), options["top_k"])
+        if mode == "decoded":
+            # What the app used to keep: a decoded 2x render per source
+            sources = [{"page": page, "image": fitz.Pixmap(store.get(page - 1))} for page in pages]
+        elif mode == "encoded":
+            sources = [{"page": page, "image": bytes(store.get(page - 1))} for page in pages]
+        else:
+            sources = [{"doc_key": "bench", "page": page, "label": f"Page {page}"} for page in pages]
+        messages.append({"role": "assistant", "content": " ".join(rng.choices(WORDS, k=120)), "sources": sources})
+
+    # Two reruns, cold and warm: every source the history loop hands to `st.image`
+    reruns = []
+    for _ in range(2):
+        start = time.perf_counter()
+        sent = 0
+        image_from = len(messages) - options["history_images"]
+        for n, message in enumerate(messages):
+            for source in message.get("sources", []):
+                if mode == "decoded":
+                    sent += len(source["image"].tobytes("png"))
+                elif mode == "encoded":
+                    sent += len(source["image"])
+                elif n >= image_from:
+                    sent += len(cached_thumbnail(source["page"]))
+        reruns.append(time.perf_counter() - start)
+
+    if mode == "decoded":
+        history = sum(len(s["image"].samples) for m in messages for s in m.get("sources", []))
+    elif mode == "encoded":
+        history = sum(len(s["image"]) for m in messages for s in m.get("sources", []))
+    else:
+        history = len(json.dumps(messages))
+    return {
+        "history_mb": history / 1024 ** 2,
+        "rerun_s": reruns,
+        "sent_mb": sent / 1024 ** 2,
+        "growth_mb": rss_mb() - baseline,
+        "peak_mb": peak_rss_mb()[0],
+    }
+
+
+def bench_chat(args):
+    """
+    Memory of a long chat session: history holding decoded page images,
+    encoded page images, or only page references with capped, lazily
+    rendered thumbnails (the app's layout). Each layout runs in a fresh
+    process over the same questions and sources.
+    """
+    options = {
+        "messages": args.messages,
+        "pages": args.pages,
+        "top_k": args.top_k,
+        "cache_entries": args.cache_entries,
+        "history_images": args.history_images,
+        "seed": args.seed,
+    }
+    rows = []
+    for mode in ("decoded", "encoded", "references"):
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            run = pool.submit(_run_chat, mode, options).result()
+        rows.append((mode, run["history_mb"], run["sent_mb"], *run["rerun_s"], run["growth_mb"], run["peak_mb"]))
+    print_table(
+        f"Chat history ({args.messages} messages, {args.top_k} sources per answer, "
+        f"{args.cache_entries} cached thumbnails, images for the last {args.history_images} messages)",
+        ["history", "session MB", "rerun MB sent", "cold rerun s", "warm rerun s", "RSS growth MB", "peak MB"],
+        rows
+    )
+
+
+# The landing page (no API key, no document) must render within these
+STARTUP_BUDGET_S = 1.0
+RERUN_BUDGET_S = 0.25
+
+# Modules the landing page must not import; they load on first real use
+HEAVY_MODULES = ("google.generativeai", "chromadb", "fitz")
+
+
+def _run_startup(reruns):
+    # Runs in its own process so the first run really is a cold start
+    import sys
+    from streamlit.testing.v1 import AppTest
+
+    start = time.perf_counter()
+    app = AppTest.from_file(os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py"), default_timeout=60)
+    app.run()
+    cold = time.perf_counter() - start
+    if app.exception:
+        raise RuntimeError(app.exception[0].value)
+    times = []
+    for _ in range(reruns):
+        start = time.perf_counter()
+        app.run()
+        times.append(time.perf_counter() - start)
+    return cold, times, [name for name in HEAVY_MODULES if name in sys.modules]
+
+
+def bench_startup(args):
+    """
+    Cold start and rerun time of the app's landing page, checked against
+    `STARTUP_BUDGET_S` and `RERUN_BUDGET_S`, plus which heavy modules it
+    imported. Times include the `streamlit.testing` harness.
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        cold, times, loaded = pool.submit(_run_startup, args.reruns).result()
+    rerun_p50, rerun_p95 = percentiles(times)
+    print_table(
+        f"App landing page ({args.reruns} reruns; budget {STARTUP_BUDGET_S}s cold, {RERUN_BUDGET_S * 1000:.0f}ms rerun p95)",
+        ["cold start s", "rerun p50", "rerun p95", "heavy imports"],
+        [(cold, rerun_p50, rerun_p95, ", ".join(loaded) or "none")]
+    )
+    over = []
+    if cold > STARTUP_BUDGET_S:
+        over.append(f"cold start {cold:.2f}s > {STARTUP_BUDGET_S}s")
+    if rerun_p95 / 1000 > RERUN_BUDGET_S:
+        over.append(f"rerun p95 {rerun_p95:.0f}ms > {RERUN_BUDGET_S * 1000:.0f}ms")
+    if loaded:
+        over.append(f"landing page imported {', '.join(loaded)}")
+    if over:
+        raise SystemExit("Over budget: " + "; ".join(over))
+
+
+# --- EMBEDDINGS ---
+def _top(vectors, query, k):
+    scores = [sum(a * b for a, b in zip(vector, query)) for vector in vectors]
+    return set(heapq.nlargest(k, range(len(vectors)), key=scores.__getitem__))
+
+
+def bench_embed(args):
+    """
+    Local embedding options on CPU: cold throughput per batch size and
+    thread count, then for each cache dtype the bytes per vector, cache
+    size, cold and warm (fully cached) time and how many of the float32
+    top-k neighbours each query still finds.
+    """
+    if args.model == "hash":
+        model = HashEmbedding()
+    else:
+        from chromadb.utils import embedding_functions
+
+        model = embedding_functions.DefaultEmbeddingFunction()
+    texts = synthetic_summaries(args.texts, seed=args.seed)
+    rng = random.Random(args.seed)
+    queries = [" ".join(rng.sample(WORDS, 3)) for _ in range(args.queries)]
+    # Load the model before anything is timed
+    model(texts[:1])
+
+    rows = []
+    for batch_size in args.batch_sizes:
+        for threads in args.threads:
+            embedder = LocalEmbedding(model, batch_size=batch_size, threads=threads, cache_dir=None)
+            start = time.perf_counter()
+            embedder(texts)
+            seconds = time.perf_counter() - start
+            rows.append((batch_size, threads, embedder.stats["batches"], seconds, len(texts) / seconds))
+    print_table(
+        f"Cold embedding ({args.model} model, {len(texts)} texts, {os.cpu_count()} CPUs)",
+        ["batch size", "threads", "model calls", "seconds", "texts/s"],
+        rows
+    )
+
+    reference = LocalEmbedding(model, cache_dir=None, dtype="float32")
+    reference_vectors = reference(texts)
+    reference_top = [_top(reference_vectors, query, args.k) for query in reference(queries)]
+    rows = []
+    for dtype in DTYPES:
+        with tempfile.TemporaryDirectory() as root:
+            embedder = LocalEmbedding(model, batch_size=max(args.batch_sizes), dtype=dtype, cache_dir=root)
+            start = time.perf_counter()
+            vectors = embedder(texts)
+            cold = time.perf_counter() - start
+            start = time.perf_counter()
+            embedder(texts)
+            warm = time.perf_counter() - start
+            db_mb = os.path.getsize(os.path.join(root, "embeddings.db")) / 1024 ** 2
+            found = [
+                len(_top(vectors, query, args.k) & top) / args.k
+                for query, top in zip(embedder(queries), reference_top)
+            ]
+        rows.append((dtype, len(quantize(vectors[0], dtype)), db_mb, cold, warm, statistics.mean(found)))
+    print_table(
+        f"Embedding cache by dtype ({len(texts)} texts, recall@{args.k} vs float32 over {len(queries)} queries)",
+        ["dtype", "bytes/vector", "cache MB", "cold s", "warm s", f"recall@{args.k}"],
+        rows
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    pipeline = sub.add_parser("pipeline", help="end-to-end ingestion throughput, query latency and memory")
+    pipeline.add_argument("--pages", type=int, nargs="+", default=[10, 100, 1000])
+    pipeline.add_argument("--latency", type=float, default=0.05)
+    pipeline.add_argument("--failure-rate", type=float, default=0.02)
+    pipeline.add_argument("--concurrency", type=int, default=8)
+    pipeline.add_argument("--pages-per-request", type=int, default=1)
+    pipeline.add_argument("--bad-batch-rate", type=float, default=0.0,
+                          help="share of batched replies the fake model garbles")
+    pipeline.add_argument("--no-regions", action="store_true", help="index and send whole pages only")
+    pipeline.add_argument("--queries", type=int, default=50)
+    pipeline.add_argument("--seed", type=int, default=0)
+    pipeline.add_argument("--trace", metavar="PATH", help="append every span to this JSONL file")
+    pipeline.set_defaults(func=bench_pipeline)
+
+    writes = sub.add_parser("writes", help="per-page vs batched vs pipelined Chroma writes")
+    writes.add_argument("--pages", type=int, nargs="+", default=[10, 100, 1000])
+    writes.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    writes.add_argument("--latency", type=float, default=0.05)
+    writes.add_argument("--concurrency", type=int, default=8)
+    writes.set_defaults(func=bench_writes)
+
+    corpus = sub.add_parser("corpus", help="retrieval latency as a multi-document corpus grows")
+    corpus.add_argument("--pages", type=int, nargs="+", default=[1000, 10000, 100000])
+    corpus.add_argument("--doc-pages", type=int, default=100)
+    corpus.add_argument("--dim", type=int, default=384)
+    corpus.add_argument("--repeats", type=int, default=50)
+    corpus.set_defaults(func=bench_corpus)
+
+    chat = sub.add_parser("chat", help="memory and rerun cost of a long chat history")
+    chat.add_argument("--messages", type=int, default=200)
+    chat.add_argument("--pages", type=int, default=30)
+    chat.add_argument("--top-k", type=int, default=3)
+    chat.add_argument("--cache-entries", type=int, default=64)
+    chat.add_argument("--history-images", type=int, default=20)
+    chat.add_argument("--seed", type=int, default=0)
+    chat.set_defaults(func=bench_chat)
+
+    startup = sub.add_parser("startup", help="app cold start and rerun time against their budget")
+    startup.add_argument("--reruns", type=int, default=20)
+    startup.set_defaults(func=bench_startup)
+
+    embed = sub.add_parser("embed", help="local embedding batch size, threads and cache dtype on CPU")
+    embed.add_argument("--model", choices=["onnx", "hash"], default="onnx",
+                       help="Chroma's all-MiniLM-L6-v2, or the offline hashing function")
+    embed.add_argument("--texts", type=int, default=2000)
+    embed.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32, 128])
+    embed.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4])
+    embed.add_argument("--queries", type=int, default=20)
+    embed.add_argument("-k", type=int, default=10)
+    embed.add_argument("--seed", type=int, default=0)
+    embed.set_defaults(func=bench_embed)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import threading
+
+from retrieval import CorpusIndex, DEFAULT_CANDIDATES, DEFAULT_TOP_K, doc_filter, rerank, retrieve, retrieve_many
+
+# Rows copied into the corpus collection per `add` call
+COPY_BATCH_SIZE = 1000
+
+# Searches over at most this many documents query their own collections
+# instead of filtering the corpus collection
+PER_DOCUMENT_SEARCH = 16
+
+
+def corpus_id(doc_key, page, region=None):
+    if region is None:
+        return f"{doc_key[:16]}:{page}"
+    return f"{doc_key[:16]}:{page}:r{region}"
+
+
+class Corpus:
+    """
+    Many indexed documents searched as one.
+
+    Every document keeps its own index cache entry; `add` copies its
+    vectors (embeddings included, so nothing is re-embedded) into the
+    shared corpus collection with `doc_id` metadata, and registers its
+    BM25 index, table store and page images. `search` narrows both sides to
+    the chosen documents: BM25 through a restricted view, and the vector
+    query by searching the documents' own collections when there are at
+    most `PER_DOCUMENT_SEARCH` of them, or the corpus collection with a
+    `doc_id` filter otherwise. Narrowing the search thus makes it cheaper
+    rather than slower.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.names = {}
+        self.pages = {}
+        self.tables = {}
+        self.collections = {}
+        self.lexical = CorpusIndex()
+        self._lock = threading.Lock()
+
+    def __contains__(self, doc_id):
+        return doc_id in self.pages
+
+    def __len__(self):
+        return len(self.pages)
+
+    @property
+    def collection(self):
+        return self.cache.vectors.corpus()
+
+    def add(self, doc_id, name, entry):
+        """Adds an index cache entry (or `run_pipeline` result) under `doc_id`."""
+        with self._lock:
+            collection = self.collection
+            existing = collection.get(where={"doc_id": doc_id}, limit=1, include=[])
+            if not existing["ids"]:
+                rows = entry["collection"].get(include=["embeddings", "documents", "metadatas"])
+                for start in range(0, len(rows["ids"]), COPY_BATCH_SIZE):
+                    metadatas = [
+                        {**meta, "doc_id": doc_id}
+                        for meta in rows["metadatas"][start:start + COPY_BATCH_SIZE]
+                    ]
+                    collection.add(
+                        ids=[corpus_id(doc_id, meta["page"], meta.get("region")) for meta in metadatas],
+                        embeddings=rows["embeddings"][start:start + COPY_BATCH_SIZE],
+                        documents=rows["documents"][start:start + COPY_BATCH_SIZE],
+                        metadatas=metadatas
+                    )
+            self.names[doc_id] = name
+            self.pages[doc_id] = entry["pages"]
+            self.tables[doc_id] = entry["tables"]
+            self.collections[doc_id] = entry["collection"]
+            self.lexical.add(doc_id, entry["lexical"])
+
+    def remove(self, doc_id):
+        with self._lock:
+            self.collection.delete(where={"doc_id": doc_id})
+            self.names.pop(doc_id, None)
+            self.pages.pop(doc_id, None)
+            self.tables.pop(doc_id, None)
+            self.collections.pop(doc_id, None)
+            self.lexical.remove(doc_id)
+
+    def prune(self):
+        """
+        Removes documents whose index cache entry has been evicted since
+        they were added (by this process or any other sharing the cache),
+        so they are indexed and added again. Returns their ids.
+        """
+        with self._lock:
+            stale = [doc_id for doc_id in self.pages if doc_id not in self.cache]
+        for doc_id in stale:
+            self.remove(doc_id)
+        return stale
+
+    def page_count(self, doc_ids=None):
+        doc_ids = self.pages if doc_ids is None else doc_ids
+        return sum(len(self.pages[doc_id]) for doc_id in doc_ids if doc_id in self.pages)
+
+    def search(self, query, doc_ids=None, top_k=DEFAULT_TOP_K, candidates=DEFAULT_CANDIDATES, embedding=None):
+        """Reranked hits (each with `doc_id`) from the given documents, or all of them."""
+        doc_ids = [doc_id for doc_id in (self.pages if doc_ids is None else doc_ids) if doc_id in self.pages]
+        if not doc_ids:
+            return []
+        hits = None
+        if len(doc_ids) <= PER_DOCUMENT_SEARCH:
+            try:
+                hits = retrieve_many(
+                    {doc_id: self.collections[doc_id] for doc_id in doc_ids}, query,
+                    candidates=candidates, embedding=embedding
+                )
+            except Exception:
+                # A document's own collection is gone; filter the corpus collection instead
+                hits = None
+        if hits is None:
+            hits = retrieve(
+                self.collection, query, candidates=candidates, embedding=embedding, where=doc_filter(doc_ids)
+            )
+        return rerank(query, hits, top_k=top_k, lexical=self.lexical.restrict(doc_ids))
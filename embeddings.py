@@ -0,0 +1,152 @@
+"""
+Local embedding function for the vector store, with batching and an
+on-disk cache.
+
+`LocalEmbedding` wraps a Chroma embedding function (by default Chroma's
+own all-MiniLM-L6-v2 ONNX model, the one collections used before) and
+embeds texts `batch_size` at a time, spreading batches over `threads`.
+Every vector is stored in a SQLite cache keyed by a hash of the model and
+the text, so a summary that was embedded once (for an earlier build, a
+resumed one, or the same page in a revised PDF) is never embedded again.
+
+Cached vectors are kept as float32 (the default), float16 or int8 (one
+scale per vector). Quantizing only shrinks this disk cache: Chroma keeps
+float32 vectors in memory and on disk whatever the cache holds. What
+goes to Chroma is always the stored vector read back, so a text embeds
+the same whether it came from the model or the cache.
+"""
+import hashlib
+import json
+import os
+import struct
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+from kv_store import KeyValueStore
+
+DEFAULT_EMBED_BATCH_SIZE = 32
+DEFAULT_EMBED_THREADS = 1
+DEFAULT_EMBED_DTYPE = "float32"
+EMBEDDING_DIR = "embeddings"
+DEFAULT_EMBEDDING_DIR = os.path.join(".index_cache", EMBEDDING_DIR)
+
+# Bytes per dimension for each storage type (int8 adds one float32 scale per vector)
+DTYPES = {"float32": 4, "float16": 2, "int8": 1}
+
+_SCALE = struct.Struct("<f")
+
+
+def quantize(vector, dtype=DEFAULT_EMBED_DTYPE):
+    """A vector as `dtype` bytes; int8 is symmetric with one scale per vector."""
+    if dtype == "float32":
+        return array("f", vector).tobytes()
+    if dtype == "float16":
+        return struct.pack(f"<{len(vector)}e", *vector)
+    if dtype == "int8":
+        scale = max((abs(x) for x in vector), default=0.0) / 127 or 1.0
+        return _SCALE.pack(scale) + array("b", [round(x / scale) for x in vector]).tobytes()
+    raise ValueError(f"Unknown embedding dtype {dtype!r}; expected one of {', '.join(DTYPES)}")
+
+
+def dequantize(data, dtype=DEFAULT_EMBED_DTYPE):
+    if dtype == "float32":
+        return array("f", data).tolist()
+    if dtype == "float16":
+        return list(struct.unpack(f"<{len(data) // 2}e", data))
+    if dtype == "int8":
+        (scale,) = _SCALE.unpack_from(data)
+        return [x * scale for x in array("b", data[_SCALE.size:])]
+    raise ValueError(f"Unknown embedding dtype {dtype!r}; expected one of {', '.join(DTYPES)}")
+
+
+class EmbeddingCache(KeyValueStore):
+    """Quantized vectors keyed by `LocalEmbedding.key`, shared by every document."""
+
+    def __init__(self, root=DEFAULT_EMBEDDING_DIR):
+        super().__init__(os.path.join(root, "embeddings.db"), "embeddings", "vector BLOB")
+
+
+class LocalEmbedding:
+    """
+    Chroma embedding function: `model` (Chroma's default when None) with
+    batching, threads and a quantized on-disk cache. It reports the
+    model's own name to Chroma, so collections built with the bare model
+    open with it unchanged.
+
+    `threads` above 1 embeds that many batches at once, which pays off for
+    models that release the GIL while they run (ONNX does) on more than
+    one core. `cache_dir=None` turns the cache off. `stats` counts texts
+    asked for, cache hits, texts embedded and model calls.
+    """
+
+    def __init__(self, model=None, batch_size=DEFAULT_EMBED_BATCH_SIZE, threads=DEFAULT_EMBED_THREADS,
+                 dtype=DEFAULT_EMBED_DTYPE, cache_dir=DEFAULT_EMBEDDING_DIR):
+        if dtype not in DTYPES:
+            raise ValueError(f"Unknown embedding dtype {dtype!r}; expected one of {', '.join(DTYPES)}")
+        self._model = model
+        self.batch_size = max(1, batch_size)
+        self.threads = max(1, threads)
+        self.dtype = dtype
+        self.cache_dir = cache_dir
+        self.cache = EmbeddingCache(cache_dir) if cache_dir else None
+        self.stats = {"texts": 0, "hits": 0, "embedded": 0, "batches": 0}
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        with self._lock:
+            if self._model is None:
+                from chromadb.utils import embedding_functions
+
+                self._model = embedding_functions.DefaultEmbeddingFunction()
+            return self._model
+
+    def name(self):
+        return self.model.name()
+
+    def get_config(self):
+        get_config = getattr(self.model, "get_config", None)
+        return get_config() if get_config else {}
+
+    def _prefix(self):
+        # The model, its config and the storage type all change the vector
+        config = json.dumps(self.get_config(), sort_keys=True, default=str)
+        return f"{self.name()}\0{config}\0{self.dtype}\0".encode()
+
+    def key(self, text, prefix=None):
+        """Cache key of `text` under this model and dtype."""
+        return hashlib.sha256((prefix or self._prefix()) + text.encode()).hexdigest()
+
+    def _embed_batch(self, batch):
+        vectors = self.model(batch)
+        with self._lock:
+            self.stats["batches"] += 1
+            self.stats["embedded"] += len(batch)
+        return [quantize([float(x) for x in vector], self.dtype) for vector in vectors]
+
+    def __call__(self, input):
+        texts = list(input)
+        prefix = self._prefix()
+        keys = {text: self.key(text, prefix) for text in texts}
+        stored = self.cache.get_many(keys.values()) if self.cache is not None else {}
+        missing = [text for text in keys if keys[text] not in stored]
+        batches = [missing[start:start + self.batch_size] for start in range(0, len(missing), self.batch_size)]
+        if self.threads > 1 and len(batches) > 1:
+            with ThreadPoolExecutor(max_workers=min(self.threads, len(batches))) as pool:
+                results = list(pool.map(self._embed_batch, batches))
+        else:
+            results = [self._embed_batch(batch) for batch in batches]
+        fresh = {}
+        for batch, vectors in zip(batches, results):
+            fresh.update((keys[text], data) for text, data in zip(batch, vectors))
+        if self.cache is not None and fresh:
+            self.cache.put_many(fresh.items())
+        stored.update(fresh)
+        with self._lock:
+            self.stats["texts"] += len(texts)
+            self.stats["hits"] += len(keys) - len(missing)
+        return [dequantize(stored[keys[text]], self.dtype) for text in texts]
+
+    def embed_query(self, input):
+        return self(input)
@@ -0,0 +1,163 @@
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+
+from scheduler import estimate_tokens
+
+
+# Vocabulary for the filler words of fake summaries
+SUMMARY_WORDS = (
+    "revenue growth margin quarter fiscal chart table segment operating cash "
+    "flow guidance forecast region product customer churn pipeline headcount "
+    "expense capital dividend share earnings outlook risk compliance audit"
+).split()
+
+
+_PAGE_LABEL = re.compile(r"Page (\d+):")
+
+
+class FakeRateLimitError(RuntimeError):
+    """Shaped like the 429 the Gemini SDK raises when a quota is exhausted."""
+
+    code = 429
+
+
+class FakeUsage:
+    def __init__(self, prompt_tokens, output_tokens):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = output_tokens
+        self.total_token_count = prompt_tokens + output_tokens
+
+
+class FakeResponse:
+    def __init__(self, text, usage_metadata=None):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+
+def _content_key(part):
+    # Image parts are identified by a hash of their bytes, not their repr
+    if isinstance(part, dict) and "data" in part:
+        return f"image:{hashlib.sha1(bytes(part['data'])).hexdigest()[:12]}"
+    return repr(part)
+
+
+class FakeModel:
+    """
+    Offline stand-in for `genai.GenerativeModel`.
+
+    Sleeps for `latency` seconds per call to mimic the network round-trip
+    and returns a summary derived from the request, so results can be
+    checked for page order and are identical across runs; `summary_words`
+    pads it with that many filler words picked from the same hash.
+    `fail_pages` lists inputs that raise on their first `fail_times`
+    calls, to exercise retries. `failure_rate` makes any call fail with
+    that probability, decided by hashing the input, the attempt number
+    and `seed`, so a run fails the same calls whatever the thread timing.
+    With `concurrency_quota`, calls beyond that many in flight get a 429.
+    With `stream=True` the same text arrives in chunks of `chunk_words`
+    words, `chunk_latency` seconds apart, with estimated token usage on
+    the last one.
+
+    A request for a JSON array over several images (a batched summary
+    request, each image preceded by its "Page N:" label) gets one holding
+    the summary each image would have had on its own; `bad_batch_rate`
+    makes that reply unparseable with the given probability, to exercise
+    the single-page fallback.
+    """
+
+    def __init__(self, latency=0.05, fail_pages=(), fail_times=1, chunk_words=3, chunk_latency=0.01,
+                 failure_rate=0.0, summary_words=0, seed=0, concurrency_quota=None, bad_batch_rate=0.0):
+        self.latency = latency
+        self.chunk_words = chunk_words
+        self.chunk_latency = chunk_latency
+        self.fail_pages = {_content_key(p) for p in fail_pages}
+        self.fail_times = fail_times
+        self.failure_rate = failure_rate
+        self.summary_words = summary_words
+        self.seed = seed
+        self.concurrency_quota = concurrency_quota
+        self.bad_batch_rate = bad_batch_rate
+        self.rate_limited = 0
+        self.calls = 0
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self._failures = {}
+        self._attempts = {}
+        self._lock = threading.Lock()
+
+    def generate_content(self, contents, stream=False):
+        response = self._respond(contents)
+        return self._chunks(response) if stream else response
+
+    def _chunks(self, response):
+        words = response.text.split(" ")
+        for start in range(0, len(words), self.chunk_words):
+            time.sleep(self.chunk_latency)
+            chunk = " ".join(words[start:start + self.chunk_words])
+            last = start + self.chunk_words >= len(words)
+            yield FakeResponse(
+                chunk if start == 0 else " " + chunk,
+                response.usage_metadata if last else None
+            )
+
+    def _roll(self, key, attempt, rate):
+        roll = hashlib.sha1(f"{self.seed}:{key}:{attempt}".encode()).digest()
+        return int.from_bytes(roll[:4], "big") / 2 ** 32 < rate
+
+    def _summary(self, key):
+        digest = hashlib.sha1(key.encode()).hexdigest()[:8]
+        text = f"Summary of {key} [{digest}]"
+        if self.summary_words:
+            rng = random.Random(digest)
+            text += " " + " ".join(rng.choice(SUMMARY_WORDS) for _ in range(self.summary_words))
+        return text
+
+    def _batch(self, contents, key, attempt):
+        if self.bad_batch_rate and self._roll(key, attempt, self.bad_batch_rate):
+            return "Here are the summaries you asked for:\n[{\"page\": 1, \"summary\": "
+        entries, label = [], None
+        for part in contents:
+            if isinstance(part, str):
+                match = _PAGE_LABEL.search(part)
+                label = int(match.group(1)) if match else label
+            elif isinstance(part, dict):
+                entries.append({"page": label, "summary": self._summary(_content_key(part))})
+        return json.dumps(entries)
+
+    def _respond(self, contents):
+        images = [part for part in contents if isinstance(part, dict)]
+        batch = len(images) > 1 and "JSON array" in str(contents[0])
+        key = "batch:" + ",".join(map(_content_key, images)) if batch else _content_key(contents[-1])
+        with self._lock:
+            self.calls += 1
+            self._in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self._in_flight)
+            attempt = self._attempts.get(key, 0)
+            self._attempts[key] = attempt + 1
+            over_quota = self.concurrency_quota is not None and self._in_flight > self.concurrency_quota
+            self.rate_limited += over_quota
+        try:
+            if over_quota:
+                time.sleep(self.latency / 5)
+                raise FakeRateLimitError("429 Resource has been exhausted (e.g. check quota).")
+            time.sleep(self.latency)
+            with self._lock:
+                if key in self.fail_pages and self._failures.get(key, 0) < self.fail_times:
+                    self._failures[key] = self._failures.get(key, 0) + 1
+                    raise RuntimeError(f"Fake failure for {key}")
+            if self.failure_rate and self._roll(key, attempt, self.failure_rate):
+                raise RuntimeError(f"Fake transient failure for {key} (attempt {attempt + 1})")
+            text = self._batch(contents, key, attempt) if batch else self._summary(key)
+            return FakeResponse(text, FakeUsage(estimate_tokens(contents), len(text) // 4 + 1))
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+
+def fake_model_factory(**options):
+    """Drop-in for `genai.GenerativeModel`: `factory(model_name)` -> FakeModel."""
+    return lambda model_name=None: FakeModel(**options)
@@ -0,0 +1,277 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+
+from embeddings import EMBEDDING_DIR
+from kv_store import KeyValueStore
+from page_store import PageStore
+from retrieval import BM25Index
+from table_store import TableStore
+from vector_store import VectorStore
+
+DEFAULT_CACHE_DIR = ".index_cache"
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+MANIFEST = "manifest.json"
+PAGES_FILE = "pages.bin"
+LEXICAL_FILE = "lexical.json"
+TABLES_FILE = "tables.json"
+PARTIAL_MANIFEST = "partial.json"
+PARTIAL_PAGES_FILE = "pages.partial.bin"
+PARTIAL_LEXICAL_FILE = "lexical.partial.json"
+PARTIAL_TABLES_FILE = "tables.partial.json"
+VECTOR_DIR = "chroma"
+SUMMARY_DB = "summaries.db"
+
+
+def document_key(pdf_bytes, **settings):
+    """Hash of the PDF content plus every setting that changes the index."""
+    h = hashlib.sha256(pdf_bytes)
+    h.update(json.dumps(settings, sort_keys=True).encode())
+    return h.hexdigest()
+
+
+def _dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class IndexCache:
+    """
+    Disk-backed store of finished document indexes, one directory per key.
+
+    Each entry holds the rendered page images (as one `PageStore` pack
+    file), the page summaries, the BM25 index and the `TableStore` of
+    extracted tables; its vectors live in the shared `VectorStore` under
+    the same key. An entry only counts once its manifest is written, so an
+    interrupted build is never served as complete; while it runs,
+    `checkpoint` keeps a partial entry that `load(key, partial=True)`
+    serves instead and a restarted build resumes from. Entries are evicted
+    least-recently-used first once the cache grows past `max_bytes`,
+    together with their collections.
+
+    `max_bytes` counts the entry directories only. The shared Chroma store,
+    the summary cache and the embedding cache live next to them and are
+    not bounded; `usage` reports all four and `python -m ingest trim`
+    shrinks the caches.
+    """
+
+    def __init__(self, root=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, vectors=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.vectors = vectors or VectorStore(os.path.join(root, VECTOR_DIR))
+        os.makedirs(root, exist_ok=True)
+
+    def entry_dir(self, key):
+        return os.path.join(self.root, key)
+
+    def __contains__(self, key):
+        return os.path.exists(os.path.join(self.entry_dir(key), MANIFEST))
+
+    def keys(self):
+        # Entry directories are named by their 64-hex-digit key; skip the
+        # vector store, job files and anything else sharing the root
+        return [
+            name for name in os.listdir(self.root)
+            if len(name) == 64 and all(c in "0123456789abcdef" for c in name)
+            and os.path.isdir(os.path.join(self.root, name))
+        ]
+
+    def open_collection(self, key, fresh=False):
+        if fresh:
+            # Claim the entry directory so `collect` leaves the build alone
+            os.makedirs(self.entry_dir(key), exist_ok=True)
+        return self.vectors.collection(key, fresh=fresh)
+
+    def begin(self, key, resume=True):
+        """
+        Claims the entry directory for a build and returns its collection
+        plus the ids an interrupted build already embedded there ("3" for
+        a page, "3:r0" for one of its regions; none unless `resume`, which
+        starts from an empty collection).
+        """
+        os.makedirs(self.entry_dir(key), exist_ok=True)
+        collection = self.vectors.collection(key, fresh=not resume)
+        embedded = set(collection.get(include=[])["ids"]) if resume else set()
+        return collection, embedded
+
+    def load(self, key, partial=False):
+        """
+        Returns the cached entry for `key`, or None on a miss. With
+        `partial`, an unfinished build's latest checkpoint counts too; its
+        entry has `partial` set and None for pages not summarized yet.
+        """
+        entry = self.entry_dir(key)
+        manifest = None
+        for name in (MANIFEST, PARTIAL_MANIFEST) if partial else (MANIFEST,):
+            try:
+                with open(os.path.join(entry, name)) as f:
+                    manifest = json.load(f)
+                break
+            except (OSError, ValueError):
+                pass
+        if manifest is None:
+            return None
+
+        try:
+            pages = PageStore.open(os.path.join(entry, manifest["pages"]))
+            with open(os.path.join(entry, manifest["lexical"])) as f:
+                lexical = BM25Index.from_dict(json.load(f))
+            tables = TableStore()
+            if manifest.get("tables"):
+                with open(os.path.join(entry, manifest["tables"])) as f:
+                    tables = TableStore.from_dict(json.load(f))
+        except (OSError, KeyError, ValueError):
+            return None
+
+        os.utime(entry)
+        return {
+            "summaries": manifest["summaries"],
+            "failed": manifest.get("failed", []),
+            "partial": manifest.get("partial", False),
+            "pages": pages,
+            "lexical": lexical,
+            "tables": tables,
+            "settings": manifest.get("settings"),
+            "collection": self.open_collection(key),
+        }
+
+    def _write_index(self, key, summaries, lexical, failed, tables=None, manifest_file=MANIFEST,
+                     pages_file=PAGES_FILE, lexical_file=LEXICAL_FILE, tables_file=TABLES_FILE, settings=None):
+        entry = self.entry_dir(key)
+        # Without `tables`, an existing table store is kept as it is
+        for name, index in ((lexical_file, lexical), (tables_file, tables)):
+            if index is None:
+                continue
+            with open(os.path.join(entry, name + ".tmp"), "w") as f:
+                json.dump(index.to_dict(), f)
+            os.replace(os.path.join(entry, name + ".tmp"), os.path.join(entry, name))
+        manifest = {
+            "created": time.time(),
+            "summaries": summaries,
+            "failed": sorted(failed),
+            "partial": manifest_file == PARTIAL_MANIFEST,
+            "pages": pages_file,
+            "lexical": lexical_file,
+            "tables": tables_file if os.path.exists(os.path.join(entry, tables_file)) else None,
+            "settings": settings,
+        }
+        tmp = os.path.join(entry, manifest_file + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp, os.path.join(entry, manifest_file))
+        os.utime(entry)
+
+    def checkpoint(self, key, summaries, pages, lexical, tables=None):
+        """
+        Saves an unfinished build: the pages rendered so far, the summaries
+        that have landed (None for the rest), their BM25 index and the
+        tables extracted so far.
+        """
+        os.makedirs(self.entry_dir(key), exist_ok=True)
+        pages.save(os.path.join(self.entry_dir(key), PARTIAL_PAGES_FILE))
+        self._write_index(
+            key, summaries, lexical, (), tables, manifest_file=PARTIAL_MANIFEST,
+            pages_file=PARTIAL_PAGES_FILE, lexical_file=PARTIAL_LEXICAL_FILE, tables_file=PARTIAL_TABLES_FILE
+        )
+
+    def commit(self, key, summaries, pages, lexical, failed=(), tables=None, settings=None):
+        """
+        Stores the page images, BM25 index and table store, marks the
+        entry complete, then trims the cache. `failed` lists pages that
+        could not be summarized; they are left out of the vectors until
+        `update` fills them in. `settings` are the build's, kept so those
+        pages are retried the same way.
+        """
+        os.makedirs(self.entry_dir(key), exist_ok=True)
+        pages.save(os.path.join(self.entry_dir(key), PAGES_FILE))
+        self._write_index(key, summaries, lexical, failed, tables, settings=settings)
+        for name in (PARTIAL_MANIFEST, PARTIAL_PAGES_FILE, PARTIAL_LEXICAL_FILE, PARTIAL_TABLES_FILE):
+            try:
+                os.remove(os.path.join(self.entry_dir(key), name))
+            except OSError:
+                pass
+        self.evict(keep={key})
+        self.collect()
+
+    def update(self, key, summaries, lexical, failed=()):
+        """Rewrites an existing entry's summaries, BM25 index and failed pages."""
+        self._write_index(key, summaries, lexical, failed, settings=self.settings(key))
+
+    def settings(self, key):
+        """The settings a complete entry was built with, or None if unknown."""
+        try:
+            with open(os.path.join(self.entry_dir(key), MANIFEST)) as f:
+                return json.load(f).get("settings")
+        except (OSError, ValueError):
+            return None
+
+    def failed_keys(self):
+        """Entries with pages still waiting to be summarized."""
+        keys = []
+        for key in self.keys():
+            try:
+                with open(os.path.join(self.entry_dir(key), MANIFEST)) as f:
+                    if json.load(f).get("failed"):
+                        keys.append(key)
+            except (OSError, ValueError):
+                pass
+        return keys
+
+    def evict(self, keep=()):
+        entries = []
+        for name in self.keys():
+            path = os.path.join(self.root, name)
+            entries.append((os.path.getmtime(path), name, _dir_size(path)))
+
+        total = sum(size for _, _, size in entries)
+        for _, name, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if name in keep:
+                continue
+            shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+            self.vectors.delete(name)
+            total -= size
+
+    def usage(self):
+        """Bytes on disk of the entries and of each shared store beside them."""
+        summaries = os.path.join(self.root, SUMMARY_DB)
+        return {
+            "entries": sum(_dir_size(self.entry_dir(key)) for key in self.keys()),
+            "vectors": _dir_size(self.vectors.path),
+            "summaries": os.path.getsize(summaries) if os.path.exists(summaries) else 0,
+            "embeddings": _dir_size(os.path.join(self.root, EMBEDDING_DIR)),
+        }
+
+    def collect(self, max_age=None):
+        """Drops collections left behind by deleted entries (or idle ones)."""
+        return self.vectors.collect(keep=set(self.keys()), max_age=max_age)
+
+
+def page_key(page_hash, **settings):
+    """Key for one page's summary: its content hash plus the settings used."""
+    return document_key(page_hash.encode(), **settings)
+
+
+class SummaryCache(KeyValueStore):
+    """
+    Page summaries keyed by `page_key`, shared by every document.
+
+    A revised PDF reuses the summaries of every page whose content did not
+    change, so only new or edited pages are sent to the model.
+    """
+
+    def __init__(self, root=DEFAULT_CACHE_DIR):
+        super().__init__(os.path.join(root, SUMMARY_DB), "summaries", "summary TEXT")
+
+    def put(self, key, summary):
+        self.put_many([(key, summary)])
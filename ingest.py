@@ -0,0 +1,714 @@
+"""
+Headless document ingestion, shared by the Streamlit app, the CLI and the
+background worker.
+
+    python -m ingest ingest report.pdf [more.pdf ...]   index now, in this process
+    python -m ingest submit report.pdf [more.pdf ...]   queue for a worker
+    python -m ingest worker --jobs 4                     process queued jobs
+    python -m ingest status                              list recent jobs
+    python -m ingest retry                               re-summarize failed pages
+    python -m ingest trim                                shrink the shared caches
+
+The CLI and worker read the API key from GOOGLE_API_KEY and pace their
+calls with `--rpm` / `--tpm`. Everything is written into the same
+persistent index cache the app reads from. Pass `--trace spans.jsonl` to
+append per-stage timings when the command exits, and `--backend fake` to
+run against the offline `FakeModel` instead.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+
+from embeddings import (
+    DEFAULT_EMBED_BATCH_SIZE, DEFAULT_EMBED_DTYPE, DEFAULT_EMBED_THREADS, DTYPES, EMBEDDING_DIR, EmbeddingCache
+)
+from index_cache import IndexCache, SummaryCache, DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES, document_key, page_key
+from page_store import PageStore
+from pdf_images import get_pdf_images, page_count, DEFAULT_ZOOM
+from retrieval import BM25Index
+from scheduler import RequestScheduler, DEFAULT_RPM, DEFAULT_TPM
+from summarizer import summarize_stream, summary_prompt, text_summary, DEFAULT_CONCURRENCY, DEFAULT_PAGES_PER_REQUEST
+from table_store import TableStore
+from telemetry import TRACER, traced_iter
+from vector_store import BatchWriter, configure_embedder, DEFAULT_BATCH_SIZE
+
+log = logging.getLogger(__name__)
+
+INDEXING_MODEL = "gemini-2.5-flash"
+
+DEFAULT_SETTINGS = {
+    "zoom": DEFAULT_ZOOM,
+    "adaptive": True,
+    "text_fast_path": True,
+    "concurrency": DEFAULT_CONCURRENCY,
+    "pages_per_request": DEFAULT_PAGES_PER_REQUEST,
+    "regions": True,
+    "batch_size": DEFAULT_BATCH_SIZE,
+    "model": INDEXING_MODEL,
+}
+
+# A running job whose worker has not reported for this long is requeued
+STALE_JOB_SECONDS = 10 * 60
+
+# How often an idle worker retries pages that failed in earlier runs
+RETRY_SWEEP_SECONDS = 5 * 60
+
+# What `trim` keeps of the shared caches `max_bytes` does not bound
+TRIM_SUMMARIES = 100_000
+TRIM_EMBEDDINGS = 200_000
+
+# A running build saves a partial entry this often, and backs off so
+# checkpoints take at most 1/CHECKPOINT_OVERHEAD of the build time
+CHECKPOINT_SECONDS = 10
+CHECKPOINT_OVERHEAD = 10
+
+
+def resolve_settings(settings=None):
+    return {**DEFAULT_SETTINGS, **(settings or {})}
+
+
+def doc_key_for(pdf_bytes, settings):
+    """Index cache key: the PDF plus every setting that changes the index."""
+    return document_key(
+        pdf_bytes,
+        zoom=settings["zoom"],
+        adaptive=settings["adaptive"],
+        text_fast_path=settings["text_fast_path"],
+        prompt=summary_prompt(settings["pages_per_request"]),
+        regions=settings["regions"],
+        model=settings["model"]
+    )
+
+
+def _lexical_index(page_texts, summaries):
+    # Lexical index over the native text layer plus the summary of every page
+    lexical = BM25Index()
+    for i, s in enumerate(summaries):
+        if s is not None or i in page_texts:
+            lexical.add(i + 1, page_texts.get(i, "") + "\n" + (s or ""))
+    return lexical
+
+
+def run_pipeline(pdf_bytes, model, settings=None, cache=None, on_progress=None, on_page_error=None,
+                 scheduler=None, resume=True):
+    """
+    Renders, summarizes and indexes one PDF into the index cache.
+
+    `settings` overrides `DEFAULT_SETTINGS` and `cache` defaults to the
+    shared `IndexCache`. Model calls go through `scheduler` when given.
+    With `resume`, an interrupted build picks up from its last checkpoint
+    instead of starting over.
+
+    `on_progress(fraction)` reports 0..1 as pages are rendered and
+    summarized; `on_page_error(index, error)` reports pages that failed
+    every retry, which are left for `retry_failed`. Both run on the
+    calling thread.
+
+    Returns the same entry `IndexCache.load` would (summaries, failed,
+    pages, lexical, tables, collection) plus `doc_key` and a `stats` dict.
+    """
+    settings = resolve_settings(settings)
+    cache = cache or IndexCache()
+    doc_key = doc_key_for(pdf_bytes, settings)
+
+    total_pages = page_count(pdf_bytes)
+    page_store = PageStore()
+    collection, embedded = cache.begin(doc_key, resume=resume)
+    writer = BatchWriter(collection, batch_size=settings["batch_size"])
+    done = [0, 0]
+    page_texts = {}
+    text_pages = {}
+    index_bytes = {}
+    regions = [0]
+    tables = TableStore()
+    landed = {}
+    next_checkpoint = [time.monotonic() + CHECKPOINT_SECONDS]
+
+    def update_progress():
+        if on_progress:
+            on_progress((done[0] + done[1]) / (2 * max(1, total_pages)))
+
+    def index_page(idx, summary):
+        landed[idx] = summary
+        if str(idx) not in embedded:
+            writer.add(idx, summary, {"page": idx + 1})
+        if time.monotonic() >= next_checkpoint[0]:
+            started = time.monotonic()
+            # Vectors must land before the checkpoint that lists their pages
+            writer.wait()
+            summaries = [landed.get(i) for i in range(total_pages)]
+            cache.checkpoint(doc_key, summaries, page_store, _lexical_index(page_texts, summaries), tables)
+            took = time.monotonic() - started
+            next_checkpoint[0] = time.monotonic() + max(CHECKPOINT_SECONDS, CHECKPOINT_OVERHEAD * took)
+
+    def rendered_pages():
+        pages = traced_iter(
+            get_pdf_images(
+                pdf_bytes, zoom=settings["zoom"], adaptive=settings["adaptive"], regions=settings["regions"]
+            ),
+            "rasterize",
+            size=lambda page: sum(len(data) for data, _ in page.variants.values())
+        )
+        for idx, variants, page_hash, text, kind, page_tables, page_regions in pages:
+            for variant, (data, mime_type) in variants.items():
+                page_store.put(idx, data, mime_type, variant=variant)
+            page_texts[idx] = text
+            for rows in page_tables:
+                tables.add_table(idx + 1, rows)
+            # Regions are indexed from their own text layer, no model call
+            for n, (_, region_text, data) in enumerate(page_regions):
+                page_store.put(idx, data, "image/png", variant=f"region{n}")
+                if f"{idx}:r{n}" not in embedded:
+                    writer.add(f"{idx}:r{n}", region_text, {"page": idx + 1, "region": n})
+            regions[0] += len(page_regions)
+            done[0] += 1
+
+            # Plain prose: its text layer is the summary, no model call needed
+            if settings["text_fast_path"] and kind == "text":
+                text_pages[idx] = text_summary(text)
+                index_page(idx, text_pages[idx])
+                done[1] += 1
+                update_progress()
+                continue
+
+            update_progress()
+            key = page_key(
+                page_hash,
+                zoom=settings["zoom"],
+                adaptive=settings["adaptive"],
+                prompt=summary_prompt(settings["pages_per_request"]),
+                model=settings["model"]
+            )
+            yield idx, idx, key
+
+    def index_part(idx):
+        part = page_store.part(idx, "index")
+        index_bytes[idx] = len(part["data"])
+        return part
+
+    def on_page(idx, summary, error):
+        done[1] += 1
+        if error and on_page_error:
+            on_page_error(idx, error)
+        # Embedding runs on the writer thread while later pages are summarized
+        if summary is not None:
+            index_page(idx, summary)
+        update_progress()
+
+    summaries, errors, hits = summarize_stream(
+        model,
+        rendered_pages(),
+        load=index_part,
+        cache=SummaryCache(cache.root),
+        concurrency=settings["concurrency"],
+        on_page=on_page,
+        total=total_pages,
+        scheduler=scheduler,
+        pages_per_request=settings["pages_per_request"]
+    )
+    summaries = [text_pages.get(i, s) for i, s in enumerate(summaries)]
+    failed = [i for i, s in enumerate(summaries) if s is None]
+    writer.close()
+
+    lexical = _lexical_index(page_texts, summaries)
+    cache.commit(doc_key, summaries, page_store, lexical, failed=failed, tables=tables, settings=settings)
+
+    return {
+        "doc_key": doc_key,
+        "summaries": summaries,
+        "failed": failed,
+        "pages": page_store,
+        "lexical": lexical,
+        "tables": tables,
+        "collection": collection,
+        "stats": {
+            "pages": len(summaries),
+            "errors": len(failed),
+            "cache_hits": hits,
+            "resumed": sum(":" not in doc_id for doc_id in embedded),
+            "cache_misses": len(summaries) - len(text_pages) - hits,
+            "text_pages": len(text_pages),
+            "tables": tables.tables,
+            "table_facts": len(tables),
+            "regions": regions[0],
+            "index_bytes": sum(index_bytes.values()),
+            "index_full_bytes": sum(len(page_store.get(idx)) for idx in index_bytes),
+            "uploaded_pages": len(index_bytes),
+        },
+    }
+
+
+def retry_failed(doc_key, model, cache=None, settings=None, scheduler=None, on_page_error=None):
+    """
+    Summarizes and indexes the pages an earlier run of `run_pipeline` could
+    not, from the images already in the cache entry. `settings` default to
+    the ones the entry was built with. Returns the page indexes that still
+    failed; they stay queued for the next attempt.
+    """
+    cache = cache or IndexCache()
+    entry = cache.load(doc_key)
+    if entry is None or not entry["failed"]:
+        return []
+    settings = resolve_settings(settings or entry["settings"])
+    summaries = entry["summaries"]
+    writer = BatchWriter(entry["collection"], batch_size=settings["batch_size"])
+
+    def on_page(idx, summary, error):
+        if summary is None:
+            if on_page_error:
+                on_page_error(idx, error)
+            return
+        summaries[idx] = summary
+        writer.add(idx, summary, {"page": idx + 1})
+        entry["lexical"].add(idx + 1, summary)
+
+    summarize_stream(
+        model,
+        ((idx, idx, None) for idx in entry["failed"]),
+        load=lambda idx: entry["pages"].part(idx, "index"),
+        concurrency=settings["concurrency"],
+        on_page=on_page,
+        scheduler=scheduler
+    )
+    writer.close()
+    failed = [idx for idx in entry["failed"] if summaries[idx] is None]
+    cache.update(doc_key, summaries, entry["lexical"], failed=failed)
+    entry["pages"].close()
+    return failed
+
+
+# --- JOB QUEUE ---
+class JobQueue:
+    """
+    Local ingestion job queue in SQLite, safe to share between the app and
+    any number of worker processes on the same machine. Submitted PDFs are
+    kept next to the database until their job finishes.
+
+    A job may name the `credential` (see `credential_id`) it must be run
+    with; only workers holding that API key claim it. The key itself is
+    never stored.
+    """
+
+    def __init__(self, root=DEFAULT_CACHE_DIR):
+        self.root = root
+        self.pdf_dir = os.path.join(root, "jobs")
+        os.makedirs(self.pdf_dir, exist_ok=True)
+        self._local = threading.local()
+        with self._db() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " doc_key TEXT NOT NULL, name TEXT NOT NULL, pdf_path TEXT NOT NULL,"
+                " settings TEXT NOT NULL, status TEXT NOT NULL, progress REAL NOT NULL DEFAULT 0,"
+                " message TEXT NOT NULL DEFAULT '', worker TEXT, credential TEXT,"
+                " created REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            # Queues created before jobs carried a credential
+            if "credential" not in {row["name"] for row in db.execute("PRAGMA table_info(jobs)")}:
+                db.execute("ALTER TABLE jobs ADD COLUMN credential TEXT")
+
+    def _db(self):
+        # One connection per thread; workers and Streamlit reruns use many threads
+        if getattr(self._local, "db", None) is None:
+            self._local.db = sqlite3.connect(os.path.join(self.root, "jobs.db"), timeout=30)
+            self._local.db.row_factory = sqlite3.Row
+        return self._local.db
+
+    def submit(self, pdf_bytes, name, settings=None, credential=None):
+        """Queues a PDF and returns its job id, reusing a pending job for the same document."""
+        settings = resolve_settings(settings)
+        doc_key = doc_key_for(pdf_bytes, settings)
+        with self._db() as db:
+            row = db.execute(
+                "SELECT id FROM jobs WHERE doc_key = ? AND status IN ('queued', 'running')",
+                (doc_key,)
+            ).fetchone()
+            if row:
+                return row["id"]
+            pdf_path = os.path.join(self.pdf_dir, f"{doc_key}.pdf")
+            with open(pdf_path, "wb") as f:
+                f.write(pdf_bytes)
+            now = time.time()
+            return db.execute(
+                "INSERT INTO jobs (doc_key, name, pdf_path, settings, status, credential, created, updated)"
+                " VALUES (?, ?, ?, ?, 'queued', ?, ?, ?)",
+                (doc_key, name, pdf_path, json.dumps(settings), credential, now, now)
+            ).lastrowid
+
+    def claim(self, worker, credentials=(), default=True):
+        """
+        Atomically takes the oldest queued job for `worker`, or returns
+        None. Only jobs for one of `credentials` qualify, plus, with
+        `default`, jobs that name no credential.
+        """
+        credentials = list(credentials)
+        allowed = []
+        if credentials:
+            allowed.append(f"credential IN ({','.join('?' * len(credentials))})")
+        if default:
+            allowed.append("credential IS NULL")
+        if not allowed:
+            return None
+        db = self._db()
+        with db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute(
+                "UPDATE jobs SET status = 'queued', worker = NULL"
+                " WHERE status = 'running' AND updated < ?",
+                (time.time() - STALE_JOB_SECONDS,)
+            )
+            row = db.execute(
+                f"SELECT * FROM jobs WHERE status = 'queued' AND ({' OR '.join(allowed)}) ORDER BY id LIMIT 1",
+                credentials
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, progress = 0, updated = ? WHERE id = ?",
+                (worker, time.time(), row["id"])
+            )
+        return dict(row)
+
+    def update(self, job_id, progress=None, message=None, status=None):
+        fields, values = ["updated = ?"], [time.time()]
+        for column, value in (("progress", progress), ("message", message), ("status", status)):
+            if value is not None:
+                fields.append(f"{column} = ?")
+                values.append(value)
+        with self._db() as db:
+            db.execute(f"UPDATE jobs SET {', '.join(fields)} WHERE id = ?", (*values, job_id))
+
+    def get(self, job_id):
+        row = self._db().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def recent(self, limit=20):
+        rows = self._db().execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,))
+        return [dict(row) for row in rows]
+
+
+# --- WORKER ---
+class Worker:
+    """
+    Runs queued jobs on `jobs` threads until stopped. `model_factory(name)`
+    builds the indexing model for a job's configured model name, paced by
+    `scheduler`.
+
+    One worker serves every API key in the process: `add_credential`
+    registers a key's model factory and scheduler (quotas are per key), and
+    jobs submitted with that key's `credential_id` run with them and nothing
+    else. Jobs without a credential run with `model_factory`; a worker built
+    without one leaves them to other workers. When there is nothing queued,
+    a worker with a `model_factory` retries pages that failed in earlier
+    runs every `RETRY_SWEEP_SECONDS`.
+    """
+
+    def __init__(self, queue, model_factory=None, jobs=2, poll=1.0, scheduler=None):
+        self.queue = queue
+        self.model_factory = model_factory
+        self.credentials = {}
+        self.jobs = jobs
+        self.poll = poll
+        self.scheduler = scheduler or RequestScheduler()
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self._stop = threading.Event()
+        self._threads = []
+        self._sweep_lock = threading.Lock()
+        self._last_sweep = 0.0
+
+    def start(self):
+        for n in range(self.jobs):
+            thread = threading.Thread(target=self._loop, args=(f"{self.name}:{n}",), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def add_credential(self, credential, model_factory, scheduler=None):
+        """Registers (or replaces, e.g. after a limit change) a key's factory and scheduler."""
+        self.credentials[credential] = (model_factory, scheduler or self.scheduler)
+        return self
+
+    def stop(self, wait=True):
+        self._stop.set()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def _loop(self, worker):
+        while not self._stop.is_set():
+            job = self.queue.claim(worker, list(self.credentials), default=self.model_factory is not None)
+            if job is None:
+                self.retry_failed_pages()
+                self._stop.wait(self.poll)
+                continue
+            self.run_job(job)
+
+    def retry_failed_pages(self):
+        if self.model_factory is None:
+            return
+        if time.time() - self._last_sweep < RETRY_SWEEP_SECONDS or not self._sweep_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_sweep = time.time()
+            cache = IndexCache(self.queue.root)
+            for doc_key in cache.failed_keys():
+                if self._stop.is_set():
+                    break
+                # One entry failing to retry must not hold up the others
+                try:
+                    settings = resolve_settings(cache.settings(doc_key))
+                    retry_failed(
+                        doc_key, self.model_factory(settings["model"]), cache=cache, settings=settings,
+                        scheduler=self.scheduler
+                    )
+                except Exception:
+                    log.exception("Retrying failed pages of %s failed", doc_key[:12])
+        except Exception:
+            log.exception("Retry sweep of %s failed", self.queue.root)
+        finally:
+            self._sweep_lock.release()
+
+    def run_job(self, job):
+        settings = json.loads(job["settings"])
+        last_update = [0.0]
+
+        def on_progress(fraction):
+            # Throttle writes: a big document reports progress per page
+            if time.time() - last_update[0] >= 0.5:
+                last_update[0] = time.time()
+                self.queue.update(job["id"], progress=fraction)
+
+        try:
+            with open(job["pdf_path"], "rb") as f:
+                pdf_bytes = f.read()
+            if job["credential"]:
+                model_factory, scheduler = self.credentials[job["credential"]]
+            else:
+                model_factory, scheduler = self.model_factory, self.scheduler
+            result = run_pipeline(
+                pdf_bytes,
+                model_factory(settings["model"]),
+                settings,
+                cache=IndexCache(self.queue.root),
+                on_progress=on_progress,
+                scheduler=scheduler
+            )
+            stats = result["stats"]
+            message = f"Indexed {stats['pages']} pages"
+            if stats["errors"]:
+                message += f" ({stats['errors']} queued for retry)"
+            self.queue.update(job["id"], progress=1.0, status="done", message=message)
+            try:
+                os.remove(job["pdf_path"])
+            except OSError:
+                pass
+        except Exception as e:
+            self.queue.update(job["id"], status="failed", message=str(e))
+
+
+# --- CLI ---
+def credential_id(api_key):
+    """Stable id of an API key for routing jobs, without storing the key."""
+    return hashlib.sha256(api_key.encode()).hexdigest()[:16]
+
+
+def gemini_model_factory(api_key=None):
+    """
+    `genai.GenerativeModel` bound to `api_key` (default $GOOGLE_API_KEY).
+    Each factory has its own client, so models for different keys can
+    live in one process; `genai.configure` would switch all of them.
+
+    The SDK has no public per-key client, so this builds its private
+    `_ClientManager` and sets the model's `_client`. requirements.txt pins
+    the SDK version this was checked against.
+    """
+    import google.generativeai as genai
+    from google.generativeai import client as genai_client
+
+    api_key = api_key or os.environ.get("GOOGLE_API_KEY")
+    if not api_key:
+        sys.exit("Set GOOGLE_API_KEY to index documents.")
+    clients = genai_client._ClientManager()
+    clients.configure(api_key=api_key)
+
+    def factory(model_name):
+        model = genai.GenerativeModel(model_name)
+        model._client = clients.get_default_client("generative")
+        return model
+
+    return factory
+
+
+def _model_factory(args):
+    if args.backend == "fake":
+        from fake_gemini import fake_model_factory
+
+        return fake_model_factory(summary_words=60)
+    return gemini_model_factory()
+
+
+def _settings_from_args(args):
+    return resolve_settings({
+        "adaptive": not args.no_adaptive,
+        "text_fast_path": not args.no_text_fast_path,
+        "concurrency": args.concurrency,
+        "pages_per_request": args.pages_per_request,
+        "regions": not args.no_regions,
+        "batch_size": args.batch_size,
+    })
+
+
+def _scheduler_from_args(args):
+    return RequestScheduler(rpm=args.rpm, tpm=args.tpm)
+
+
+def _cmd_ingest(args):
+    model_factory = _model_factory(args)
+    settings = _settings_from_args(args)
+    scheduler = _scheduler_from_args(args)
+    for path in args.pdfs:
+        with open(path, "rb") as f:
+            pdf_bytes = f.read()
+        start = time.perf_counter()
+
+        def on_progress(fraction):
+            print(f"\r{os.path.basename(path)}: {fraction:6.1%}", end="", flush=True)
+
+        result = run_pipeline(
+            pdf_bytes,
+            model_factory(settings["model"]),
+            settings,
+            cache=IndexCache(args.cache_dir),
+            on_progress=on_progress,
+            on_page_error=lambda idx, e: print(f"\n  page {idx + 1} failed: {e}"),
+            scheduler=scheduler
+        )
+        print(f"\r{os.path.basename(path)}: {json.dumps(result['stats'])} in {time.perf_counter() - start:.1f}s")
+
+
+def _cmd_submit(args):
+    queue = JobQueue(args.cache_dir)
+    settings = _settings_from_args(args)
+    for path in args.pdfs:
+        with open(path, "rb") as f:
+            job_id = queue.submit(f.read(), os.path.basename(path), settings)
+        print(f"{path}: job {job_id}")
+
+
+def _cmd_worker(args):
+    model_factory = _model_factory(args)
+    worker = Worker(JobQueue(args.cache_dir), model_factory, jobs=args.jobs, scheduler=_scheduler_from_args(args))
+    if args.backend == "gemini":
+        # Also serve jobs the app submitted with this same key
+        worker.add_credential(credential_id(os.environ["GOOGLE_API_KEY"]), model_factory)
+    worker.start()
+    print(f"Worker {worker.name} running {args.jobs} job(s) at a time; Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        worker.stop(wait=False)
+
+
+def _cmd_status(args):
+    for job in JobQueue(args.cache_dir).recent(args.limit):
+        print(f"{job['id']:>5}  {job['status']:<8} {job['progress']:6.1%}  {job['name']}  {job['message']}")
+
+
+def _cmd_retry(args):
+    cache = IndexCache(args.cache_dir)
+    model_factory = _model_factory(args)
+    scheduler = _scheduler_from_args(args)
+    for doc_key in cache.failed_keys():
+        settings = resolve_settings(cache.settings(doc_key))
+        failed = retry_failed(
+            doc_key, model_factory(settings["model"]), cache=cache, settings=settings, scheduler=scheduler
+        )
+        print(f"{doc_key[:12]}: {len(failed)} pages still failing")
+
+
+def _cmd_trim(args):
+    cache = IndexCache(args.cache_dir, max_bytes=args.max_bytes)
+    before = cache.usage()
+    cache.evict()
+    collections = cache.collect()
+    summaries = SummaryCache(cache.root).trim(args.max_summaries)
+    embeddings = EmbeddingCache(os.path.join(cache.root, EMBEDDING_DIR)).trim(args.max_embeddings)
+    print(f"Dropped {collections} orphaned collections, {summaries} summaries and {embeddings} embeddings")
+    for name, size in cache.usage().items():
+        print(f"  {name:<10} {before[name] / 1024 ** 2:10.1f} MB -> {size / 1024 ** 2:10.1f} MB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--trace", metavar="PATH", help="append pipeline spans to this JSONL file on exit")
+    parser.add_argument("--backend", choices=["gemini", "fake"], default="gemini",
+                        help="model backend; `fake` needs no API key or network")
+    parser.add_argument("--rpm", type=int, default=DEFAULT_RPM, help="model requests per minute")
+    parser.add_argument("--tpm", type=int, default=DEFAULT_TPM, help="model tokens per minute")
+    parser.add_argument("--embed-batch-size", type=int, default=DEFAULT_EMBED_BATCH_SIZE,
+                        help="texts encoded per local embedding model call")
+    parser.add_argument("--embed-threads", type=int, default=DEFAULT_EMBED_THREADS,
+                        help="embedding batches encoded at the same time")
+    parser.add_argument("--embed-dtype", choices=list(DTYPES), default=DEFAULT_EMBED_DTYPE,
+                        help="storage type of the on-disk embedding cache")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    for name, func, help_text in (
+        ("ingest", _cmd_ingest, "index PDFs now, in this process"),
+        ("submit", _cmd_submit, "queue PDFs for a background worker"),
+    ):
+        cmd = sub.add_parser(name, help=help_text)
+        cmd.add_argument("pdfs", nargs="+")
+        cmd.add_argument("--no-adaptive", action="store_true", help="fixed zoom, no light indexing images")
+        cmd.add_argument("--no-text-fast-path", action="store_true", help="send text pages to the model too")
+        cmd.add_argument("--no-regions", action="store_true", help="index whole pages only, not their regions")
+        cmd.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+        cmd.add_argument("--pages-per-request", type=int, default=DEFAULT_PAGES_PER_REQUEST,
+                         help="page images summarized per model request")
+        cmd.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+        cmd.set_defaults(func=func)
+
+    worker = sub.add_parser("worker", help="process queued jobs until interrupted")
+    worker.add_argument("--jobs", type=int, default=2, help="documents indexed in parallel")
+    worker.set_defaults(func=_cmd_worker)
+
+    status = sub.add_parser("status", help="list recent jobs")
+    status.add_argument("--limit", type=int, default=20)
+    status.set_defaults(func=_cmd_status)
+
+    retry = sub.add_parser("retry", help="re-summarize pages that failed in earlier runs")
+    retry.set_defaults(func=_cmd_retry)
+
+    trim = sub.add_parser("trim", help="evict entries and shrink the summary and embedding caches")
+    trim.add_argument("--max-bytes", type=int, default=DEFAULT_MAX_BYTES, help="budget for the index entries")
+    trim.add_argument("--max-summaries", type=int, default=TRIM_SUMMARIES,
+                      help="most recently written page summaries to keep")
+    trim.add_argument("--max-embeddings", type=int, default=TRIM_EMBEDDINGS,
+                      help="most recently written embeddings to keep")
+    trim.set_defaults(func=_cmd_trim)
+
+    args = parser.parse_args(argv)
+    configure_embedder(
+        batch_size=args.embed_batch_size,
+        threads=args.embed_threads,
+        dtype=args.embed_dtype,
+        cache_dir=os.path.join(args.cache_dir, EMBEDDING_DIR)
+    )
+    try:
+        args.func(args)
+    finally:
+        if args.trace:
+            TRACER.export(args.trace)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+import os
+import sqlite3
+import threading
+
+# Keys per `IN (...)` query, well under SQLite's bound-parameter limit
+QUERY_CHUNK = 500
+
+
+class KeyValueStore:
+    """
+    One SQLite table of `key` -> `value_column`, safe to share between
+    threads. The summary and embedding caches are built on it.
+    """
+
+    def __init__(self, path, table, value_column):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.table = table
+        self.value_column = value_column.split()[0]
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, {value_column} NOT NULL)")
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def get_many(self, keys):
+        found = {}
+        keys = list(set(keys))
+        with self._lock:
+            for start in range(0, len(keys), QUERY_CHUNK):
+                chunk = keys[start:start + QUERY_CHUNK]
+                rows = self._db.execute(
+                    f"SELECT key, {self.value_column} FROM {self.table} WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk
+                )
+                found.update(rows)
+        return found
+
+    def put_many(self, items):
+        with self._lock, self._db:
+            self._db.executemany(f"INSERT OR REPLACE INTO {self.table} VALUES (?, ?)", list(items))
+
+    def trim(self, max_rows):
+        """
+        Keeps the `max_rows` most recently written rows (a replaced row
+        counts as new), compacts the file and returns how many rows went.
+        """
+        with self._lock:
+            with self._db:
+                removed = self._db.execute(
+                    f"DELETE FROM {self.table} WHERE rowid <= "
+                    f"(SELECT rowid FROM {self.table} ORDER BY rowid DESC LIMIT 1 OFFSET ?)",
+                    (max(0, max_rows),)
+                ).rowcount
+            if removed:
+                self._db.execute("VACUUM")
+        return removed
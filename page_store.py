@@ -0,0 +1,152 @@
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import weakref
+
+DEFAULT_MEMORY_LIMIT = 256 * 1024 ** 2
+
+_HEADER = struct.Struct("<Q")
+
+
+def _cleanup(spill, maps):
+    for m in maps:
+        try:
+            m.close()
+        except (BufferError, ValueError):
+            pass
+    if spill is not None:
+        spill.close()
+        try:
+            os.remove(spill.name)
+        except OSError:
+            pass
+
+
+class PageStore:
+    """
+    Encoded page images for one session, addressed by page index and
+    variant ("answer" for the full-quality image, optionally "index" for a
+    lighter one used while summarizing).
+
+    Images stay in memory until `memory_limit` bytes are held; later pages
+    go to a private spill file that is read back through mmap. A store can
+    also be saved as a single pack file and reopened read-only straight
+    from it. Everything is released when the store is closed or garbage
+    collected, e.g. when its Streamlit session ends.
+    """
+
+    def __init__(self, memory_limit=DEFAULT_MEMORY_LIMIT, spill_dir=None):
+        self.memory_limit = memory_limit
+        self.spill_dir = spill_dir
+        self.memory_bytes = 0
+        self._memory = {}
+        self._spilled = {}
+        self._mime = {}
+        self._spill = None
+        self._map = None
+        self._maps = []
+        self._readonly = False
+        self._lock = threading.Lock()
+        self._finalizer = weakref.finalize(self, _cleanup, None, self._maps)
+
+    def __len__(self):
+        return len({idx for idx, _ in self._mime})
+
+    def __contains__(self, idx):
+        return (idx, "answer") in self._mime
+
+    def indices(self):
+        return sorted({idx for idx, _ in self._mime})
+
+    def put(self, idx, data, mime_type="image/png", variant="answer"):
+        if self._readonly:
+            raise ValueError("PageStore opened from a pack file is read-only")
+        key = (idx, variant)
+        with self._lock:
+            # A page stored again replaces its old image (whose spilled bytes stay unused)
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self.memory_bytes -= len(old)
+            self._spilled.pop(key, None)
+            if self.memory_bytes + len(data) <= self.memory_limit:
+                self._memory[key] = data
+                self.memory_bytes += len(data)
+            else:
+                if self._spill is None:
+                    self._spill = tempfile.NamedTemporaryFile(
+                        prefix="pages_", suffix=".spill", dir=self.spill_dir, delete=False
+                    )
+                    self._finalizer.detach()
+                    self._finalizer = weakref.finalize(self, _cleanup, self._spill, self._maps)
+                self._spill.seek(0, os.SEEK_END)
+                self._spilled[key] = (self._spill.tell(), len(data))
+                self._spill.write(data)
+            self._mime[key] = mime_type
+
+    def _key(self, idx, variant):
+        # Pages rendered without a lighter variant fall back to the full image
+        return (idx, variant) if (idx, variant) in self._mime else (idx, "answer")
+
+    def get(self, idx, variant="answer"):
+        key = self._key(idx, variant)
+        with self._lock:
+            if key in self._memory:
+                return self._memory[key]
+            offset, length = self._spilled[key]
+            if self._map is None or len(self._map) < offset + length:
+                # Reads are copied out, so the old map can go as soon as the file has grown
+                self._spill.flush()
+                if self._map is not None:
+                    self._maps.remove(self._map)
+                    self._map.close()
+                self._map = mmap.mmap(self._spill.fileno(), 0, access=mmap.ACCESS_READ)
+                self._maps.append(self._map)
+            return self._map[offset:offset + length]
+
+    def part(self, idx, variant="answer"):
+        """The page as an inline image part for `generate_content`."""
+        return {"mime_type": self._mime[self._key(idx, variant)], "data": self.get(idx, variant)}
+
+    def save(self, path):
+        """Writes every image to one pack file: a JSON index, then the data."""
+        keys = sorted(self._mime)
+        index = []
+        offset = 0
+        for idx, variant in keys:
+            length = len(self.get(idx, variant))
+            index.append([idx, variant, offset, length, self._mime[(idx, variant)]])
+            offset += length
+        header = json.dumps(index).encode()
+
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(_HEADER.pack(len(header)))
+            f.write(header)
+            for idx, variant in keys:
+                f.write(self.get(idx, variant))
+        os.replace(tmp, path)
+
+    @classmethod
+    def open(cls, path):
+        """Read-only store mapped from a pack file written by `save`."""
+        store = cls(memory_limit=0)
+        with open(path, "rb") as f:
+            store._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        store._maps.append(store._map)
+        (header_len,) = _HEADER.unpack_from(store._map, 0)
+        base = _HEADER.size + header_len
+        for idx, variant, offset, length, mime_type in json.loads(store._map[_HEADER.size:base]):
+            store._spilled[(idx, variant)] = (base + offset, length)
+            store._mime[(idx, variant)] = mime_type
+        store._readonly = True
+        return store
+
+    def close(self):
+        self._finalizer()
+        self._memory.clear()
+        self._spilled.clear()
+        self._mime.clear()
+        self._map = None
@@ -0,0 +1,264 @@
+import hashlib
+import multiprocessing
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+DEFAULT_ZOOM = 2
+
+# Adaptive rendering: dense pages (big tables, charts) are rendered sharper
+# for answering, and every page also gets a half-size JPEG for indexing.
+DENSE_ZOOM = 3
+DENSE_WORDS_PER_CELL = 15  # words per 100x100pt of page area
+DENSE_DRAWINGS = 60
+INDEX_JPEG_QUALITY = 60
+
+# Chat history shows sources as small JPEGs rather than full page renders
+THUMBNAIL_WIDTH = 400
+THUMBNAIL_JPEG_QUALITY = 70
+
+# Page classification: a "text" page has a clean, substantial text layer
+# and nothing visual, so it can be indexed from its text alone. Anything
+# with raster images, charts / ruled tables or no real text (scans) is
+# "visual" and goes to the vision model.
+TEXT_MIN_WORDS = 80
+TEXT_MIN_COVERAGE = 0.25
+TEXT_MAX_DRAWINGS = 10
+
+# Ruled tables are drawn with vector lines; pages with fewer drawings skip
+# table detection, which costs tens of milliseconds a page
+TABLE_MIN_DRAWINGS = 4
+
+# Region-level chunking: content areas closer than REGION_GAP points are
+# one region; regions outside REGION_MIN_AREA..REGION_MAX_AREA of the page
+# or with fewer than REGION_MIN_WORDS words of text are not worth their
+# own index entry
+REGION_GAP = 12
+REGION_PADDING = 6
+REGION_MIN_AREA = 0.04
+REGION_MAX_AREA = 0.8
+REGION_MIN_WORDS = 3
+MAX_REGIONS = 8
+
+# Below this many pages, spinning up worker processes costs more than it saves
+MIN_PARALLEL_PAGES = 8
+
+_worker_doc = None
+
+RenderedPage = namedtuple(
+    "RenderedPage", ["index", "variants", "content_hash", "text", "kind", "tables", "regions"]
+)
+
+
+def page_count(pdf_bytes):
+    # PyMuPDF is imported on first use so the app's landing page does not pay for it
+    import fitz
+
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        return len(doc)
+
+
+def page_features(page):
+    """Cheap layout statistics from the page's content stream."""
+    area = max(1.0, page.rect.width * page.rect.height)
+    blocks = [b for b in page.get_text("blocks") if b[6] == 0]
+    text_area = sum((b[2] - b[0]) * (b[3] - b[1]) for b in blocks)
+    return {
+        "area": area,
+        "words": len(page.get_text("words")),
+        "text_coverage": min(1.0, text_area / area),
+        "images": len(page.get_images(full=False)),
+        "drawings": len(page.get_drawings()),
+    }
+
+
+def choose_zoom(features, base=DEFAULT_ZOOM):
+    """Picks a sharper zoom for pages whose text or vector drawings are dense."""
+    cells = max(1.0, features["area"] / 10000)
+    if features["words"] / cells >= DENSE_WORDS_PER_CELL:
+        return max(base, DENSE_ZOOM)
+    if features["drawings"] >= DENSE_DRAWINGS:
+        return max(base, DENSE_ZOOM)
+    return base
+
+
+def classify_page(features):
+    """"text" for plain prose pages, "visual" for charts, tables and scans."""
+    if features["images"] or features["drawings"] > TEXT_MAX_DRAWINGS:
+        return "visual"
+    if features["words"] < TEXT_MIN_WORDS or features["text_coverage"] < TEXT_MIN_COVERAGE:
+        return "visual"
+    return "text"
+
+
+def extract_tables(page, features):
+    """Tables on the page as lists of rows of cell text, via PyMuPDF's `find_tables`."""
+    if features["drawings"] < TABLE_MIN_DRAWINGS:
+        return []
+    try:
+        found = page.find_tables()
+    except Exception:
+        # Older PyMuPDF has no table finder, and it can fail on odd pages
+        return []
+    return [table.extract() for table in found.tables]
+
+
+def _merge_rects(rects, gap):
+    import fitz
+
+    rects = [fitz.Rect(r) for r in rects]
+    merged = True
+    while merged:
+        merged = False
+        out = []
+        for rect in rects:
+            for n, other in enumerate(out):
+                if fitz.Rect(other.x0 - gap, other.y0 - gap, other.x1 + gap, other.y1 + gap).intersects(rect):
+                    out[n] = other | rect
+                    merged = True
+                    break
+            else:
+                out.append(rect)
+        rects = out
+    return rects
+
+
+def find_regions(page):
+    """
+    The page's separate content areas (a chart, a table, a run of
+    paragraphs) as clip rectangles, largest first: text and image blocks
+    and clusters of vector drawings, merged where they are less than
+    `REGION_GAP` apart. Empty when the page is one undivided area.
+    """
+    import fitz
+
+    rects = [fitz.Rect(block[:4]) for block in page.get_text("blocks")]
+    try:
+        rects += page.cluster_drawings(x_tolerance=REGION_GAP, y_tolerance=REGION_GAP)
+    except Exception:
+        # Older PyMuPDF has no drawing clustering
+        rects += [drawing["rect"] for drawing in page.get_drawings()]
+    area = abs(page.rect)
+    regions = []
+    for rect in _merge_rects([r for r in rects if not r.is_empty], REGION_GAP):
+        rect = fitz.Rect(
+            rect.x0 - REGION_PADDING, rect.y0 - REGION_PADDING, rect.x1 + REGION_PADDING, rect.y1 + REGION_PADDING
+        ) & page.rect
+        if REGION_MIN_AREA * area <= abs(rect) <= REGION_MAX_AREA * area:
+            regions.append(rect)
+    if len(regions) < 2:
+        return []
+    return sorted(regions, key=lambda rect: -abs(rect))[:MAX_REGIONS]
+
+
+def _render_regions(page, zoom):
+    import fitz
+
+    regions = []
+    for rect in find_regions(page):
+        text = page.get_text(clip=rect)
+        if len(text.split()) < REGION_MIN_WORDS:
+            continue
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=rect)
+        regions.append((tuple(rect), text, pix.tobytes("png")))
+    return regions
+
+
+def _render_page(doc, i, zoom, adaptive, regions=False):
+    import fitz
+
+    page = doc.load_page(i)
+    features = page_features(page)
+    if adaptive:
+        zoom = choose_zoom(features, zoom)
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+    variants = {"answer": (pix.tobytes("png"), "image/png")}
+    if adaptive:
+        # Copy without alpha: recent PyMuPDF adds one on a plain copy and JPEG cannot carry it
+        small = fitz.Pixmap(pix, 0)
+        small.shrink(1)
+        variants["index"] = (small.tobytes("jpeg", jpg_quality=INDEX_JPEG_QUALITY), "image/jpeg")
+    return RenderedPage(
+        i, variants, hashlib.sha256(pix.samples).hexdigest(), page.get_text(), classify_page(features),
+        extract_tables(page, features), _render_regions(page, zoom) if regions else []
+    )
+
+
+def thumbnail(data, width=THUMBNAIL_WIDTH):
+    """
+    A small JPEG of an encoded page image, halved until it is at most
+    about `width` pixels wide.
+    """
+    import fitz
+
+    pix = fitz.Pixmap(bytes(data))
+    if pix.alpha:
+        pix = fitz.Pixmap(pix, 0)
+    factor = 0
+    while pix.width >> factor > width * 1.5:
+        factor += 1
+    if factor:
+        pix.shrink(factor)
+    return pix.tobytes("jpeg", jpg_quality=THUMBNAIL_JPEG_QUALITY)
+
+
+def _init_worker(pdf_bytes):
+    global _worker_doc
+    import fitz
+
+    _worker_doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+
+
+def _render_in_worker(i, zoom, adaptive, regions):
+    return _render_page(_worker_doc, i, zoom, adaptive, regions)
+
+
+def get_pdf_images(pdf_bytes, zoom=DEFAULT_ZOOM, adaptive=False, workers=None, regions=False):
+    """
+    Renders every page and yields a `RenderedPage` (index, variants,
+    content_hash, text, kind, tables, regions) as soon as each page is
+    ready, in completion order. Nothing touches the disk. `text` is the
+    page's native text layer, `kind` its `classify_page` result and
+    `tables` what `extract_tables` found on it.
+
+    With `regions`, each area `find_regions` picks out is also rendered on
+    its own at the page's zoom, as (rect, text, png_bytes), so it can be
+    indexed and sent to the model without the rest of the page.
+
+    `variants` maps a use to (encoded_bytes, mime_type). "answer" is a PNG
+    at `zoom`. With `adaptive`, dense pages get `DENSE_ZOOM` instead and an
+    "index" variant is added: the same render at half size as JPEG, which
+    is plenty for a search summary and a fraction of the upload.
+
+    Pages are rendered in a process pool; each worker opens the document
+    once and at most two pages per worker are in flight at a time, so
+    memory stays flat no matter how long the PDF is as long as the caller
+    moves pages somewhere bounded (see `page_store.PageStore`).
+    """
+    total = page_count(pdf_bytes)
+    workers = workers or min(os.cpu_count() or 1, 8)
+
+    if workers <= 1 or total < MIN_PARALLEL_PAGES:
+        import fitz
+
+        with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+            for i in range(total):
+                yield _render_page(doc, i, zoom, adaptive, regions)
+        return
+
+    # Spawn rather than fork: the Streamlit server process is multi-threaded
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(pdf_bytes,)
+    ) as pool:
+        next_page = 0
+        pending = set()
+        while next_page < total or pending:
+            while next_page < total and len(pending) < workers * 2:
+                pending.add(pool.submit(_render_in_worker, next_page, zoom, adaptive, regions))
+                next_page += 1
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
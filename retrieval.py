@@ -0,0 +1,356 @@
+import heapq
+import math
+import re
+from collections import Counter
+
+from telemetry import span
+
+DEFAULT_TOP_K = 3
+DEFAULT_CANDIDATES = 10
+DEFAULT_IMAGE_BUDGET = 4 * 1024 ** 2
+
+# Weight of the vector score vs. the lexical score in `rerank`
+VECTOR_WEIGHT = 0.6
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# In a corpus, query terms on more than this share of pages (and at least
+# COMMON_TERM_PAGES pages) only rescore pages that rarer terms found,
+# instead of walking their long postings
+COMMON_TERM_RATIO = 0.05
+COMMON_TERM_PAGES = 1000
+
+_TOKEN = re.compile(r"[a-z0-9][a-z0-9.%$-]*")
+_STOPWORDS = set(
+    "a an and are as at be by can do does for from how in is it of on or "
+    "shown show that the this to was were what when where which who why with "
+    "you your i me my we our there their any about document page pages".split()
+)
+
+
+def tokenize(text):
+    return [t.rstrip(".") for t in _TOKEN.findall(text.lower()) if t not in _STOPWORDS]
+
+
+class BM25Index:
+    """
+    In-memory inverted index with BM25 scoring over each page's native text
+    layer plus its summary. Catches exact figures, tickers and table labels
+    a summary may leave out, without any model call; a search only touches
+    the postings of the query terms.
+    """
+
+    def __init__(self):
+        self.postings = {}
+        self.lengths = {}
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def add(self, page, text):
+        """Indexes `text` under `page`, extending what the page already has."""
+        counts = Counter(tokenize(text))
+        self.lengths[page] = self.lengths.get(page, 0) + sum(counts.values())
+        for term, tf in counts.items():
+            postings = self.postings.setdefault(term, {})
+            postings[page] = postings.get(page, 0) + tf
+
+    def search(self, query, k=DEFAULT_CANDIDATES):
+        """Best pages for `query` as [(page, score)], highest first."""
+        n = len(self.lengths)
+        if n == 0:
+            return []
+        avg_len = sum(self.lengths.values()) / n or 1.0
+        scores = Counter()
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for page, tf in postings.items():
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[page] / avg_len)
+                scores[page] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return scores.most_common(k)
+
+    def to_dict(self):
+        return {"postings": self.postings, "lengths": self.lengths}
+
+    @classmethod
+    def from_dict(cls, data):
+        # JSON turns the integer page keys into strings
+        index = cls()
+        index.lengths = {int(page): length for page, length in data["lengths"].items()}
+        index.postings = {
+            term: {int(page): tf for page, tf in postings.items()}
+            for term, postings in data["postings"].items()
+        }
+        return index
+
+
+class CorpusIndex:
+    """
+    BM25 across many documents' `BM25Index`es, scored with corpus-wide
+    document frequencies and lengths so pages from different documents
+    compete fairly. Results are keyed by (doc_id, page). `restrict` gives a
+    view over some of the documents without copying their postings.
+    """
+
+    def __init__(self, indexes=None):
+        self.indexes = {}
+        self._sizes = {}
+        for doc_id, index in (indexes or {}).items():
+            self.add(doc_id, index)
+
+    def __len__(self):
+        return sum(n for n, _ in self._sizes.values())
+
+    def __contains__(self, doc_id):
+        return doc_id in self.indexes
+
+    def add(self, doc_id, index):
+        self.indexes[doc_id] = index
+        self._sizes[doc_id] = (len(index), sum(index.lengths.values()))
+
+    def remove(self, doc_id):
+        self.indexes.pop(doc_id, None)
+        self._sizes.pop(doc_id, None)
+
+    def restrict(self, doc_ids):
+        view = CorpusIndex()
+        for doc_id in doc_ids:
+            if doc_id in self.indexes:
+                view.indexes[doc_id] = self.indexes[doc_id]
+                view._sizes[doc_id] = self._sizes[doc_id]
+        return view
+
+    def _score(self, scores, key, idf, tf, avg_len):
+        length = self.indexes[key[0]].lengths[key[1]]
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * length / avg_len)
+        scores[key] = scores.get(key, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+    def search(self, query, k=DEFAULT_CANDIDATES):
+        """
+        Best pages for `query` as [((doc_id, page), score)], highest first.
+        A query made only of very common terms finds nothing here and is
+        left to the vector side of `rerank`.
+        """
+        n = len(self)
+        if n == 0:
+            return []
+        avg_len = sum(total for _, total in self._sizes.values()) / n or 1.0
+        scores = {}
+        common = []
+        for term in set(tokenize(query)):
+            postings = [(doc_id, index.postings.get(term)) for doc_id, index in self.indexes.items()]
+            postings = [(doc_id, p) for doc_id, p in postings if p]
+            df = sum(len(p) for _, p in postings)
+            if not df:
+                continue
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            if df > max(COMMON_TERM_PAGES, COMMON_TERM_RATIO * n):
+                common.append((idf, dict(postings)))
+                continue
+            for doc_id, pages in postings:
+                for page, tf in pages.items():
+                    self._score(scores, (doc_id, page), idf, tf, avg_len)
+        for idf, postings in common:
+            for key in scores:
+                tf = postings.get(key[0], {}).get(key[1])
+                if tf:
+                    self._score(scores, key, idf, tf, avg_len)
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+
+def doc_filter(doc_ids):
+    """Chroma `where` clause limiting a corpus query to `doc_ids`."""
+    doc_ids = list(doc_ids)
+    if len(doc_ids) == 1:
+        return {"doc_id": doc_ids[0]}
+    return {"doc_id": {"$in": doc_ids}}
+
+
+def page_ref(hit):
+    """A hit's page number, or (doc_id, page) for hits from a corpus."""
+    return (hit["doc_id"], hit["page"]) if "doc_id" in hit else hit["page"]
+
+
+def retrieve(collection, query, candidates=DEFAULT_CANDIDATES, embedding=None, where=None):
+    """
+    Nearest page summaries for `query` as [{page, document, distance}];
+    hits on a page region also carry its `region` number. Pass `embedding`
+    when the query was already embedded to skip doing it again inside
+    Chroma. `where` pre-filters on metadata (see `doc_filter`); hits from
+    a corpus collection also carry their `doc_id`.
+    """
+    n = min(candidates, collection.count())
+    if n == 0:
+        return []
+    with span("retrieve", candidates=n, filtered=where is not None):
+        if embedding is not None:
+            results = collection.query(query_embeddings=[embedding], n_results=n, where=where)
+        else:
+            results = collection.query(query_texts=[query], n_results=n, where=where)
+    hits = []
+    for meta, doc, dist in zip(
+        results["metadatas"][0], results["documents"][0], results["distances"][0]
+    ):
+        hit = {"page": meta["page"], "document": doc, "distance": dist}
+        for field in ("region", "doc_id"):
+            if field in meta:
+                hit[field] = meta[field]
+        hits.append(hit)
+    return hits
+
+
+def retrieve_many(collections, query, candidates=DEFAULT_CANDIDATES, embedding=None):
+    """
+    `retrieve` over several documents' own collections ({doc_id:
+    collection}), merged by distance into the `candidates` nearest hits,
+    each tagged with its `doc_id`. For a few documents this beats a
+    `doc_filter` query on a large corpus collection, whose metadata
+    filter has to scan every row.
+    """
+    hits = []
+    for doc_id, collection in collections.items():
+        hits += [
+            {**hit, "doc_id": doc_id}
+            for hit in retrieve(collection, query, candidates=candidates, embedding=embedding)
+        ]
+    return sorted(hits, key=lambda hit: hit["distance"])[:candidates]
+
+
+def _overlap_scores(query, hits):
+    # How much of the query, weighted by rarity across the candidates,
+    # appears in each summary
+    terms = set(tokenize(query))
+    docs = [set(tokenize(hit["document"])) for hit in hits]
+    idf = {
+        t: math.log(1 + len(docs) / (1 + sum(t in d for d in docs)))
+        for t in terms
+    }
+    total_idf = sum(idf.values()) or 1.0
+    return {
+        page_ref(hit): sum(idf[t] for t in terms if t in doc) / total_idf
+        for hit, doc in zip(hits, docs)
+    }
+
+
+def _lexical_hit(ref):
+    if isinstance(ref, tuple):
+        return {"doc_id": ref[0], "page": ref[1], "document": "", "distance": None}
+    return {"page": ref, "document": "", "distance": None}
+
+
+def rerank(query, hits, top_k=DEFAULT_TOP_K, lexical=None):
+    """
+    Reorders vector hits by blending their similarity with a lexical score.
+
+    With a `BM25Index` (or a `CorpusIndex`), its best pages join the
+    candidates (so a page the vector search missed can still win on an
+    exact figure) and BM25 scores are the lexical side. Without one, the
+    lexical side is the query's overlap with each candidate summary. Both
+    sides are normalized to 0..1 before blending. A page found both whole
+    and through its regions keeps only its best-scoring hit. Runs locally
+    in well under a millisecond.
+    """
+    if lexical is not None and len(lexical):
+        bm25 = dict(lexical.search(query))
+        seen = {page_ref(hit) for hit in hits}
+        hits = hits + [
+            _lexical_hit(ref) for ref in bm25 if ref not in seen
+        ]
+        top = max(bm25.values(), default=0) or 1.0
+        lexical_scores = {page: score / top for page, score in bm25.items()}
+    else:
+        lexical_scores = _overlap_scores(query, hits)
+    if not hits:
+        return []
+
+    distances = [hit["distance"] for hit in hits if hit["distance"] is not None]
+    lo, hi = min(distances, default=0), max(distances, default=0)
+    for hit in hits:
+        if hit["distance"] is None:
+            vector = 0.0
+        else:
+            vector = 1.0 if hi == lo else (hi - hit["distance"]) / (hi - lo)
+        hit["score"] = VECTOR_WEIGHT * vector + (1 - VECTOR_WEIGHT) * lexical_scores.get(page_ref(hit), 0.0)
+    best = {}
+    for hit in sorted(hits, key=lambda hit: hit["score"], reverse=True):
+        best.setdefault(page_ref(hit), hit)
+    return list(best.values())[:top_k]
+
+
+def pack_pages(hits, page_store, budget=DEFAULT_IMAGE_BUDGET):
+    """
+    Picks page images, best first, until `budget` bytes are used. A page
+    that does not fit at full quality is sent as its lighter indexing
+    variant if that fits. A region hit sends just its crop. If nothing of
+    the best page fits, its smallest image is sent anyway. For corpus
+    hits, `page_store` maps each doc_id to its `PageStore`. Hits on pages
+    the store does not hold yet (a partial index) are skipped.
+
+    Returns [(page_ref, part)]: the page number, or (doc_id, page).
+    """
+    packed = []
+    used = 0
+    for hit in hits:
+        idx = hit["page"] - 1
+        store = page_store[hit["doc_id"]] if "doc_id" in hit else page_store
+        if idx not in store:
+            continue
+        variants = ("answer", "index") if "region" not in hit else (f"region{hit['region']}", "answer", "index")
+        parts = []
+        for variant in variants:
+            part = store.part(idx, variant)
+            if used + len(part["data"]) <= budget:
+                packed.append((page_ref(hit), part))
+                used += len(part["data"])
+                break
+            parts.append(part)
+        else:
+            if not packed:
+                part = min(parts, key=lambda part: len(part["data"]))
+                packed.append((page_ref(hit), part))
+                used += len(part["data"])
+    return packed
+
+
+def page_label(ref, names=None):
+    """Display label for a page ref: `Page 3`, or `report.pdf, page 3` in a corpus."""
+    if isinstance(ref, tuple):
+        doc_id, page = ref
+        return f"{(names or {}).get(doc_id, doc_id[:8])}, page {page}"
+    return f"Page {ref}"
+
+
+def build_contents(query, packed, names=None):
+    """
+    Prompt plus labelled page images for one multi-image reasoning call.
+    `names` maps doc_ids to file names for corpus pages.
+    """
+    pages = "; ".join(page_label(ref, names) for ref, _ in packed)
+    contents = [
+        f"Using the provided document page images ({pages}), answer this question in detail: {query}\n\n"
+        "Provide specific information, numbers, and insights from the images, "
+        "combining pages where the answer spans more than one, and cite the pages you used."
+    ]
+    for ref, part in packed:
+        contents.append(f"{page_label(ref, names)}:")
+        contents.append(part)
+    return contents
+
+
+def stream_text(response):
+    """
+    Yields the text of a streamed `generate_content` response chunk by
+    chunk, skipping chunks that carry no text (e.g. a final chunk with
+    only the finish reason).
+    """
+    for chunk in response:
+        try:
+            text = chunk.text
+        except ValueError:
+            continue
+        if text:
+            yield text
@@ -0,0 +1,198 @@
+import random
+import re
+import threading
+import time
+
+from telemetry import generate
+
+# Conservative defaults for a paid Gemini Flash key; the app exposes both
+DEFAULT_RPM = 1000
+DEFAULT_TPM = 1000000
+DEFAULT_MAX_CONCURRENCY = 32
+DEFAULT_RETRIES = 4
+DEFAULT_BACKOFF = 1.0
+DEFAULT_MAX_BACKOFF = 60.0
+
+# Buckets hold this many seconds of quota, so a burst cannot spend a whole minute at once
+BURST_SECONDS = 10
+
+# Rough request size for the token bucket: Gemini bills an inline image flat
+IMAGE_TOKENS = 258
+
+_RETRYABLE = {"ResourceExhausted", "TooManyRequests", "ServiceUnavailable",
+              "InternalServerError", "DeadlineExceeded", "GatewayTimeout"}
+_RETRY_DELAYS = (
+    re.compile(r"retry in (\d+(?:\.\d+)?)\s*s", re.IGNORECASE),
+    re.compile(r"retry_delay\s*\{\s*seconds:\s*(\d+)"),
+)
+
+
+def is_rate_limit(error):
+    message = str(error).lower()
+    return (
+        getattr(error, "code", None) == 429
+        or type(error).__name__ in ("ResourceExhausted", "TooManyRequests")
+        or message.startswith("429")
+        or "quota" in message
+        or "resource has been exhausted" in message
+    )
+
+
+def is_retryable(error):
+    return (
+        is_rate_limit(error)
+        or type(error).__name__ in _RETRYABLE
+        or getattr(error, "code", None) in (500, 502, 503, 504)
+    )
+
+
+def retry_after(error):
+    """The server's suggested delay in seconds ("Please retry in 31.2s"), if any."""
+    for pattern in _RETRY_DELAYS:
+        match = pattern.search(str(error))
+        if match:
+            return float(match.group(1))
+    return None
+
+
+def estimate_tokens(contents):
+    return sum(
+        IMAGE_TOKENS if isinstance(part, dict) else len(str(part)) // 4 + 1
+        for part in (contents if isinstance(contents, (list, tuple)) else [contents])
+    )
+
+
+class TokenBucket:
+    """
+    `per_minute` units refilled continuously, holding at most
+    `BURST_SECONDS` worth. `acquire` blocks until the units are available;
+    `charge` settles a difference afterwards and may leave the bucket in
+    debt, which later callers then wait out.
+    """
+
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * BURST_SECONDS)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount=1.0):
+        """Takes `amount` units, waiting as needed; returns the seconds waited."""
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return waited
+                delay = (amount - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def charge(self, amount):
+        with self._lock:
+            self._refill()
+            self.tokens -= amount
+
+
+class RequestScheduler:
+    """
+    One gate for every Gemini call in the process, indexing and chat alike.
+
+    Calls wait for a request and an estimated-token budget from per-minute
+    token buckets, and for a concurrency slot. The number of slots adapts
+    AIMD-style: it grows by one per window of successful calls and halves
+    on every 429. A rate-limited or transient failure is retried with
+    full-jitter exponential backoff (or the delay the server asks for), and
+    a 429 pauses every caller until that delay has passed, so a burst of
+    threads does not hammer an exhausted quota. Errors that are not
+    transient are raised at once.
+    """
+
+    def __init__(self, rpm=DEFAULT_RPM, tpm=DEFAULT_TPM, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF, max_backoff=DEFAULT_MAX_BACKOFF):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_concurrency = max(1, max_concurrency)
+        self.limit = float(self.max_concurrency)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.stats = {"calls": 0, "retries": 0, "rate_limited": 0, "failed": 0, "wait_s": 0.0}
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._cond = threading.Condition()
+
+    def _enter(self, started):
+        with self._cond:
+            while True:
+                pause = self._paused_until - time.monotonic()
+                if pause > 0:
+                    self._cond.wait(pause)
+                elif self._in_flight >= int(self.limit):
+                    self._cond.wait()
+                else:
+                    self._in_flight += 1
+                    self.stats["calls"] += 1
+                    self.stats["wait_s"] += time.monotonic() - started
+                    return
+
+    def _leave(self, error=None, rate_limited=False, delay=0.0, retry=False):
+        with self._cond:
+            self._in_flight -= 1
+            if error is not None:
+                self.stats["rate_limited"] += rate_limited
+                self.stats["retries" if retry else "failed"] += 1
+            if rate_limited:
+                self.limit = max(1.0, self.limit / 2)
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            else:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+    def _delay(self, attempt, error):
+        suggested = retry_after(error)
+        if suggested is not None:
+            return min(self.max_backoff, suggested) + random.uniform(0, self.backoff)
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def call(self, fn, tokens=0):
+        """Runs `fn()` under the limits; `tokens` is its estimated cost."""
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            self.requests.acquire()
+            self.tokens.acquire(tokens)
+            self._enter(started)
+            try:
+                result = fn()
+            except Exception as e:
+                rate_limited = is_rate_limit(e)
+                retry = attempt < self.retries and is_retryable(e)
+                delay = self._delay(attempt, e)
+                self._leave(e, rate_limited, delay if rate_limited else 0.0, retry)
+                if not retry:
+                    raise
+                attempt += 1
+                if not rate_limited:
+                    # A 429 already paused every caller in `_leave`
+                    time.sleep(delay)
+                continue
+            self._leave()
+            return result
+
+    def generate(self, model, contents, stage, stream=False, **attrs):
+        """`telemetry.generate` under the scheduler, settling the real token usage."""
+        estimate = estimate_tokens(contents)
+        response = self.call(lambda: generate(model, contents, stage, stream=stream, **attrs), tokens=estimate)
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None and getattr(usage, "total_token_count", None):
+            self.tokens.charge(usage.total_token_count - estimate)
+        return response
@@ -0,0 +1,213 @@
+import json
+import random
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from telemetry import generate
+
+SUMMARY_PROMPT = "Summarize this page accurately for search."
+
+# Batched requests label each image "Page N:" and ask for one JSON entry per page
+BATCH_PROMPT = (
+    "Summarize each of the following pages accurately for search. Every image is preceded by "
+    "its page label. Reply with only a JSON array holding one object per page, in order: "
+    '[{"page": <page number>, "summary": "<summary>"}, ...]'
+)
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_RETRIES = 2
+DEFAULT_BACKOFF = 1.0
+DEFAULT_PAGES_PER_REQUEST = 1
+
+# Text-native pages are indexed from their own text, trimmed to this length
+TEXT_SUMMARY_CHARS = 2000
+
+
+_JSON_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+
+def summary_prompt(pages_per_request=DEFAULT_PAGES_PER_REQUEST):
+    return SUMMARY_PROMPT if pages_per_request <= 1 else BATCH_PROMPT
+
+
+def _generate(model, contents, scheduler, **attrs):
+    if scheduler is not None:
+        return scheduler.generate(model, contents, "summarize", **attrs)
+    return generate(model, contents, "summarize", **attrs)
+
+
+def _summarize_page(model, prompt, page, load, scheduler):
+    image = load(page) if load else page
+    return _generate(model, [prompt, image], scheduler).text
+
+
+def _summarize_batch(model, indexes, pages, load, scheduler):
+    contents = [BATCH_PROMPT]
+    for idx in indexes:
+        contents += [f"Page {idx + 1}:", load(pages[idx]) if load else pages[idx]]
+    return parse_batch(_generate(model, contents, scheduler, pages=len(indexes)).text, indexes)
+
+
+def parse_batch(text, indexes):
+    """
+    Per-page summaries from a batched reply, as {page index: summary}.
+
+    Only entries for requested pages with a non-empty string summary are
+    kept; a reply that is not a JSON array of objects yields nothing, and
+    pages missing from the result are left to single-page calls.
+    """
+    try:
+        entries = json.loads(_JSON_FENCE.sub("", text.strip()))
+    except ValueError:
+        return {}
+    if not isinstance(entries, list):
+        return {}
+    wanted = {idx + 1 for idx in indexes}
+    summaries = {}
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        page, summary = entry.get("page"), entry.get("summary")
+        if isinstance(page, str) and page.strip().isdigit():
+            page = int(page)
+        if page in wanted and isinstance(summary, str) and summary.strip():
+            summaries.setdefault(page - 1, summary.strip())
+    return summaries
+
+
+def summarize_stream(model, items, prompt=SUMMARY_PROMPT, load=None, cache=None,
+                     concurrency=DEFAULT_CONCURRENCY, retries=DEFAULT_RETRIES,
+                     backoff=DEFAULT_BACKOFF, on_page=None, total=0, scheduler=None,
+                     pages_per_request=DEFAULT_PAGES_PER_REQUEST):
+    """
+    Summarizes pages as they arrive, with at most `concurrency` requests in
+    flight.
+
+    `items` yields (index, page, key) in any order, so it can be fed
+    straight from a renderer that is still working on later pages. `page`
+    is an image or anything `load` turns into one (e.g. a path and
+    `Image.open`). When a `cache` is given, pages whose key it already
+    holds skip the model and fresh summaries are stored as they arrive.
+
+    Pages that fail are retried in a later round, once everything else has
+    settled, so one bad page never holds up the others. With a
+    `scheduler.RequestScheduler`, each call is also rate limited and
+    retried on 429s and transient errors before it counts as failed.
+    `on_page(index, summary, error)` runs on the calling thread as each
+    page settles, which keeps it safe for Streamlit widgets.
+
+    With `pages_per_request` above 1, fresh pages are sent that many to a
+    request with `BATCH_PROMPT` and the JSON reply is split back into
+    per-page summaries. Pages the reply leaves out or garbles, and every
+    page of a batch that fails outright, fall back to single-page calls
+    with `prompt`.
+
+    Returns (summaries, errors, hits): summaries in page order (None for
+    pages that never succeeded or never arrived; at least `total` long), a
+    dict of page index -> last exception, and the number of cache hits.
+    """
+    summaries = {}
+    errors = {}
+    pages = {}
+    keys = {}
+    failed = []
+    pending = []
+    count = total
+    hits = 0
+    attempt = 0
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futures = {}
+
+        def submit(idx):
+            futures[pool.submit(_summarize_page, model, prompt, pages[idx], load, scheduler)] = idx
+
+        def submit_batch():
+            if len(pending) == 1:
+                submit(pending[0])
+            elif pending:
+                futures[pool.submit(_summarize_batch, model, list(pending), pages, load, scheduler)] = tuple(pending)
+            pending.clear()
+
+        def store(idx, summary):
+            summaries[idx] = summary
+            errors.pop(idx, None)
+            if cache is not None and keys.get(idx) is not None:
+                cache.put(keys[idx], summary)
+
+        def settle(future):
+            idx = futures.pop(future)
+            if isinstance(idx, tuple):
+                try:
+                    parsed = future.result()
+                except Exception:
+                    parsed = {}
+                for page in idx:
+                    if page in parsed:
+                        store(page, parsed[page])
+                        if on_page:
+                            on_page(page, parsed[page], None)
+                    else:
+                        submit(page)
+                return
+            try:
+                store(idx, future.result())
+            except Exception as e:
+                errors[idx] = e
+                failed.append(idx)
+                if attempt < retries:
+                    return
+            if on_page:
+                on_page(idx, summaries.get(idx), errors.get(idx))
+
+        for idx, page, key in items:
+            count = max(count, idx + 1)
+            cached = None
+            if cache is not None and key is not None:
+                cached = cache.get_many([key]).get(key)
+            if cached is not None:
+                summaries[idx] = cached
+                hits += 1
+                if on_page:
+                    on_page(idx, cached, None)
+            else:
+                pages[idx] = page
+                keys[idx] = key
+                if pages_per_request <= 1:
+                    submit(idx)
+                else:
+                    pending.append(idx)
+                    if len(pending) >= pages_per_request:
+                        submit_batch()
+            for future in [f for f in futures if f.done()]:
+                settle(future)
+        submit_batch()
+
+        while True:
+            # Batches settle into single-page calls, so drain until nothing is in flight
+            while futures:
+                for future in as_completed(list(futures)):
+                    settle(future)
+            if not failed or attempt >= retries:
+                break
+            attempt += 1
+            time.sleep(random.uniform(0.5, 1.0) * backoff * 2 ** (attempt - 1))
+            retry, failed[:] = sorted(failed), []
+            for idx in retry:
+                submit(idx)
+
+    return [summaries.get(idx) for idx in range(count)], errors, hits
+
+
+def summarize_pages(model, pages, **kwargs):
+    """`summarize_stream` over an in-memory list; returns (summaries, errors)."""
+    summaries, errors, _ = summarize_stream(
+        model, ((idx, page, None) for idx, page in enumerate(pages)), **kwargs
+    )
+    return summaries, errors
+
+
+def text_summary(text, limit=TEXT_SUMMARY_CHARS):
+    """Search summary for a text-native page, straight from its text layer."""
+    return " ".join(text.split())[:limit]
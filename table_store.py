@@ -0,0 +1,209 @@
+"""
+Numbers from the tables found on document pages, kept in a columnar
+store so lookups like "what was revenue in 2023" are answered without a
+model call.
+
+Every numeric cell becomes one fact: its page, table, row and column,
+the row label (the first cell of its row), the column label (the header
+cell above it), the parsed value and the cell text as printed. Facts are
+stored column by column, and the label words are indexed so a lookup only
+looks at facts whose row and column labels both match the question.
+"""
+import re
+from array import array
+
+from retrieval import page_label
+
+DEFAULT_MAX_FACTS = 5
+
+_NUMBER = re.compile(r"^\(?([-+−]?)[$€£]?\s*(\d[\d,]*(?:\.\d+)?)\s*(%|[kmb]n?)?\)?$", re.IGNORECASE)
+_TOKEN = re.compile(r"[a-z]+|\d+(?:\.\d+)?")
+# Header cells that look numeric but name a period: 2023, FY2023, FY 23, Q1 2023, Q1'23, 2023 Q1
+_PERIOD = re.compile(
+    r"^(?:(?:19|20)\d{2}(?:\s*(?:q[1-4]|h[12]))?|(?:fy|q[1-4]|h[12])\s*'?\s*(?:(?:19|20)\d{2}|\d{2}))$",
+    re.IGNORECASE
+)
+
+# Words that say nothing about which row or column is meant
+STOPWORDS = frozenset(
+    "a an and are as at by did do does for from how in is it of on or the to was were what when "
+    "which who with show shown value values much many amount figure number percentage percent".split()
+)
+
+
+def parse_number(text):
+    """The value of a numeric cell ("$4.2M", "(1,200)", "+12%"), or None."""
+    match = _NUMBER.match(" ".join(str(text).split()))
+    if not match:
+        return None
+    sign, digits, _ = match.groups()
+    value = float(digits.replace(",", ""))
+    negative = sign in ("-", "−") or str(text).strip().startswith("(")
+    return -value if negative else value
+
+
+def is_period(text):
+    """Whether a cell is a year or fiscal period label rather than a value."""
+    return bool(_PERIOD.match(" ".join(str(text).split())))
+
+
+def _tokens(text):
+    return {token for token in _TOKEN.findall(str(text).lower()) if token not in STOPWORDS}
+
+
+def _label(cell):
+    return " ".join(str(cell or "").split())
+
+
+class TableStore:
+    """Columnar store of table facts for one document."""
+
+    def __init__(self):
+        self.tables = 0
+        self.page = array("i")
+        self.table = array("i")
+        self.row = array("i")
+        self.col = array("i")
+        self.value = array("d")
+        self.row_label = []
+        self.col_label = []
+        self.text = []
+        self._postings = None
+
+    def __len__(self):
+        return len(self.value)
+
+    def add_table(self, page, rows):
+        """
+        Adds one extracted table (a list of rows of cell strings). The
+        first row is its header and the first column its row labels.
+        Year and period headers ("2023", "FY2023", "Q1 2023") count as
+        labels; tables with only numbers in their header are skipped,
+        since their columns cannot be told apart. Returns the number of
+        facts added.
+        """
+        rows = [[_label(cell) for cell in row] for row in rows if row]
+        if len(rows) < 2 or len(rows[0]) < 2:
+            return 0
+        header = rows[0]
+        if all((parse_number(cell) is not None and not is_period(cell)) or not cell for cell in header[1:]):
+            return 0
+        table = self.tables
+        self.tables += 1
+        added = 0
+        for r, row in enumerate(rows[1:], start=1):
+            if not row[0]:
+                continue
+            for c, cell in enumerate(row[1:], start=1):
+                value = parse_number(cell)
+                if value is None or c >= len(header) or not header[c]:
+                    continue
+                self.page.append(page)
+                self.table.append(table)
+                self.row.append(r)
+                self.col.append(c)
+                self.value.append(value)
+                self.row_label.append(row[0])
+                self.col_label.append(header[c])
+                self.text.append(cell)
+                added += 1
+        self._postings = None
+        return added
+
+    def _index(self):
+        if self._postings is None:
+            rows, cols = {}, {}
+            for i, (row_label, col_label) in enumerate(zip(self.row_label, self.col_label)):
+                for token in _tokens(row_label):
+                    rows.setdefault(token, []).append(i)
+                for token in _tokens(col_label):
+                    cols.setdefault(token, []).append(i)
+            self._postings = (rows, cols)
+        return self._postings
+
+    def lookup(self, query, limit=DEFAULT_MAX_FACTS):
+        """
+        Facts whose row and column labels together contain every word of
+        `query` (stopwords aside), with each label matching at least one.
+        Anything else in the question ("explain the revenue trend",
+        "revenue in Asia") means it needs more than a lookup, and the
+        result is empty. Facts whose labels say least beyond the query come
+        first. Each fact is a dict of page, row and column labels, value
+        and text.
+        """
+        terms = _tokens(query)
+        if not terms or not len(self):
+            return []
+        rows, cols = self._index()
+        row_terms, col_terms = {}, {}
+        for term in terms:
+            for i in rows.get(term, ()):
+                row_terms.setdefault(i, set()).add(term)
+            for i in cols.get(term, ()):
+                col_terms.setdefault(i, set()).add(term)
+        matches = sorted(
+            (i for i in row_terms if i in col_terms and row_terms[i] | col_terms[i] >= terms),
+            key=lambda i: (
+                len(_tokens(self.row_label[i]) | _tokens(self.col_label[i])), self.page[i], i
+            )
+        )
+        return [
+            {
+                "page": self.page[i],
+                "row": self.row_label[i],
+                "column": self.col_label[i],
+                "value": self.value[i],
+                "text": self.text[i],
+            }
+            for i in matches[:limit]
+        ]
+
+    def to_dict(self):
+        return {
+            "tables": self.tables,
+            "page": list(self.page),
+            "table": list(self.table),
+            "row": list(self.row),
+            "col": list(self.col),
+            "value": list(self.value),
+            "row_label": self.row_label,
+            "col_label": self.col_label,
+            "text": self.text,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        store = cls()
+        store.tables = data["tables"]
+        for name in ("page", "table", "row", "col", "value"):
+            getattr(store, name).extend(data[name])
+        store.row_label = data["row_label"]
+        store.col_label = data["col_label"]
+        store.text = data["text"]
+        return store
+
+
+def lookup_tables(query, stores, limit=DEFAULT_MAX_FACTS):
+    """
+    `TableStore.lookup` over one store, or over a dict of doc_id -> store
+    for a corpus, in which case each fact also carries its `doc_id`.
+    """
+    if isinstance(stores, TableStore):
+        return stores.lookup(query, limit)
+    facts = []
+    for doc_id, store in stores.items():
+        facts += [{**fact, "doc_id": doc_id} for fact in store.lookup(query, limit)]
+    return facts[:limit]
+
+
+def fact_ref(fact):
+    """A fact's page as retrieval refers to it: the page number, or (doc_id, page)."""
+    return (fact["doc_id"], fact["page"]) if "doc_id" in fact else fact["page"]
+
+
+def format_facts(facts, names=None):
+    """Markdown answer listing each fact with the page it came from."""
+    return "\n".join(
+        f"- **{fact['row']} / {fact['column']}:** {fact['text']} ({page_label(fact_ref(fact), names)})"
+        for fact in facts
+    )
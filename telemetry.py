@@ -0,0 +1,193 @@
+"""
+Per-stage tracing for the indexing and query pipeline.
+
+Every instrumented call (rendering a page, a `generate_content` request,
+a Chroma add or query) becomes one span: its stage, wall time, the bytes
+it moved and, for model calls, token usage. Spans go to a bounded
+in-memory buffer shared by the process; `summary` aggregates them per
+stage and `to_jsonl` exports them raw.
+"""
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+DEFAULT_MAX_SPANS = 10000
+
+STAGES = ("rasterize", "summarize", "embed", "embed_query", "retrieve", "reason")
+
+
+def payload_bytes(contents):
+    """Bytes of text and inline image data in a `generate_content` payload."""
+    total = 0
+    for part in contents if isinstance(contents, (list, tuple)) else [contents]:
+        if isinstance(part, str):
+            total += len(part.encode())
+        elif isinstance(part, (bytes, bytearray, memoryview)):
+            total += len(part)
+        elif isinstance(part, dict) and "data" in part:
+            total += len(part["data"])
+    return total
+
+
+def usage(response):
+    """Token counts from a Gemini response (or final stream chunk), if reported."""
+    meta = getattr(response, "usage_metadata", None)
+    if meta is None:
+        return {}
+    return {
+        "prompt_tokens": getattr(meta, "prompt_token_count", 0) or 0,
+        "output_tokens": getattr(meta, "candidates_token_count", 0) or 0,
+        "total_tokens": getattr(meta, "total_token_count", 0) or 0,
+    }
+
+
+def _percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+class Tracer:
+    """Thread-safe buffer of the last `max_spans` spans."""
+
+    def __init__(self, max_spans=DEFAULT_MAX_SPANS):
+        self._spans = deque(maxlen=max_spans)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._spans)
+
+    @contextmanager
+    def span(self, stage, **attrs):
+        """Times the block; the yielded dict takes extra fields (bytes, tokens)."""
+        record = {"stage": stage, "start": time.time(), **attrs}
+        started = time.perf_counter()
+        try:
+            yield record
+        except Exception as e:
+            record["error"] = repr(e)
+            raise
+        finally:
+            record["seconds"] = time.perf_counter() - started
+            self.add(record)
+
+    def add(self, record):
+        with self._lock:
+            self._spans.append(record)
+
+    def spans(self, stage=None):
+        with self._lock:
+            spans = list(self._spans)
+        return [s for s in spans if stage is None or s["stage"] == stage]
+
+    def clear(self):
+        with self._lock:
+            self._spans.clear()
+
+    def summary(self):
+        """One row per stage: calls, errors, total and p50/p95 time, bytes and tokens."""
+        by_stage = {}
+        for s in self.spans():
+            by_stage.setdefault(s["stage"], []).append(s)
+        order = {stage: n for n, stage in enumerate(STAGES)}
+        rows = []
+        for stage in sorted(by_stage, key=lambda stage: order.get(stage, len(order))):
+            spans = by_stage[stage]
+            times = sorted(s["seconds"] for s in spans)
+            rows.append({
+                "stage": stage,
+                "calls": len(spans),
+                "errors": sum("error" in s for s in spans),
+                "total_s": round(sum(times), 3),
+                "p50_ms": round(_percentile(times, 0.5) * 1000, 1),
+                "p95_ms": round(_percentile(times, 0.95) * 1000, 1),
+                "bytes": sum(s.get("bytes", 0) for s in spans),
+                "tokens": sum(s.get("total_tokens", 0) for s in spans),
+            })
+        return rows
+
+    def to_jsonl(self):
+        return "".join(json.dumps(s, default=str) + "\n" for s in self.spans())
+
+    def export(self, path):
+        with open(path, "a") as f:
+            f.write(self.to_jsonl())
+
+
+TRACER = Tracer()
+
+
+def span(stage, **attrs):
+    return TRACER.span(stage, **attrs)
+
+
+def traced_iter(iterable, stage, size=None):
+    """
+    Yields from `iterable`, recording the time spent waiting for each item
+    (so a producer running ahead costs nothing) and `size(item)` bytes.
+    """
+    iterator = iter(iterable)
+    while True:
+        record = {"stage": stage, "start": time.time()}
+        started = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        except Exception as e:
+            record["error"] = repr(e)
+            record["seconds"] = time.perf_counter() - started
+            TRACER.add(record)
+            raise
+        record["seconds"] = time.perf_counter() - started
+        if size:
+            record["bytes"] = size(item)
+        TRACER.add(record)
+        yield item
+
+
+class TracedStream:
+    """
+    A streamed response that records its span once fully consumed: total
+    time, time to first chunk and the usage reported on the last chunk.
+    """
+
+    def __init__(self, response, record, started):
+        self.response = response
+        self.record = record
+        self.started = started
+
+    def __iter__(self):
+        last = None
+        try:
+            for chunk in self.response:
+                if last is None:
+                    self.record["first_chunk_s"] = time.perf_counter() - self.started
+                last = chunk
+                yield chunk
+        except Exception as e:
+            self.record["error"] = repr(e)
+            raise
+        finally:
+            self.record.update(usage(last) if last is not None else {})
+            self.record["seconds"] = time.perf_counter() - self.started
+            TRACER.add(self.record)
+
+
+def generate(model, contents, stage, stream=False, **attrs):
+    """`model.generate_content(contents)` recorded as one `stage` span."""
+    if not stream:
+        with span(stage, bytes=payload_bytes(contents), **attrs) as record:
+            response = model.generate_content(contents)
+            record.update(usage(response))
+        return response
+    record = {"stage": stage, "start": time.time(), "bytes": payload_bytes(contents), **attrs}
+    started = time.perf_counter()
+    try:
+        response = model.generate_content(contents, stream=True)
+    except Exception as e:
+        record["error"] = repr(e)
+        record["seconds"] = time.perf_counter() - started
+        TRACER.add(record)
+        raise
+    return TracedStream(response, record, started)
@@ -0,0 +1,25 @@
+from answer_cache import AnswerCache
+
+
+def test_similar_lookup_only_refreshes_the_entry_it_serves():
+    cache = AnswerCache(max_entries=3)
+    cache.put("doc", "what was revenue", [1, 2], [1.0, 0.0], "served")
+    cache.put("other", "unrelated", [1, 2], [1.0, 0.0], "other")
+    cache.put("doc", "who is the ceo", [5], [0.0, 1.0], "scanned")
+
+    hit = cache.get_similar("doc", [2, 1], [0.99, 0.05])
+    assert hit["answer"] == "served"
+
+    # Two more puts evict the two least recently used: "other", then the
+    # entry the lookup scanned past but did not serve.
+    cache.put("other", "second", [3], [1.0, 0.0], "second")
+    cache.put("other", "third", [3], [1.0, 0.0], "third")
+    assert cache.get_exact("doc", "who is the ceo") is None
+    assert cache.get_exact("doc", "What was revenue?")["answer"] == "served"
+
+
+def test_similar_lookup_needs_the_same_pages():
+    cache = AnswerCache()
+    cache.put("doc", "what was revenue", [1, 2], [1.0, 0.0], "served")
+    assert cache.get_similar("doc", [1, 3], [1.0, 0.0]) is None
+    assert cache.get_similar("other", [1, 2], [1.0, 0.0]) is None
@@ -0,0 +1,43 @@
+from bench import HashEmbedding
+from corpus import Corpus
+from index_cache import IndexCache
+from page_store import PageStore
+from retrieval import BM25Index
+from vector_store import VectorStore
+
+KEY_A = "a" * 64
+KEY_B = "b" * 64
+
+
+def _index(cache, key, text):
+    collection = cache.open_collection(key, fresh=True)
+    collection.add(ids=["0"], documents=[text], metadatas=[{"page": 1}])
+    pages = PageStore()
+    pages.put(0, b"page image")
+    lexical = BM25Index()
+    lexical.add(1, text)
+    cache.commit(key, [text], pages, lexical)
+
+
+def test_evicted_documents_leave_the_corpus(tmp_path):
+    cache = IndexCache(
+        str(tmp_path), max_bytes=1,
+        vectors=VectorStore(str(tmp_path / "chroma"), embedding_function=HashEmbedding())
+    )
+    corpus = Corpus(cache)
+    _index(cache, KEY_A, "quarterly revenue by region")
+    corpus.add(KEY_A, "a.pdf", cache.load(KEY_A))
+
+    # Committing another entry over budget evicts the first
+    _index(cache, KEY_B, "headcount and hiring plan")
+    assert KEY_A not in cache
+    assert corpus.prune() == [KEY_A]
+    assert KEY_A not in corpus
+
+    # Indexed again, it is searchable through its vectors once more
+    _index(cache, KEY_A, "quarterly revenue by region")
+    corpus.add(KEY_A, "a.pdf", cache.load(KEY_A))
+    query = "quarterly revenue"
+    hits = corpus.search(query, doc_ids=[KEY_A], embedding=HashEmbedding().embed(query))
+    assert hits and hits[0]["distance"] is not None
+    assert corpus.prune() == []
@@ -0,0 +1,33 @@
+import time
+
+import ingest
+from bench import HashEmbedding, synthetic_pdf
+from fake_gemini import FakeModel
+from index_cache import IndexCache
+from vector_store import BatchWriter, VectorStore
+
+
+def test_checkpointed_pages_are_embedded(tmp_path, monkeypatch):
+    cache = IndexCache(str(tmp_path), vectors=VectorStore(str(tmp_path / "chroma"), embedding_function=HashEmbedding()))
+    monkeypatch.setattr(ingest, "CHECKPOINT_SECONDS", 0)
+    monkeypatch.setattr(ingest, "CHECKPOINT_OVERHEAD", 0)
+    # Slow writes leave batches in flight whenever a checkpoint is taken
+    add = BatchWriter._add
+    monkeypatch.setattr(BatchWriter, "_add", lambda self, batch: time.sleep(0.05) or add(self, batch))
+
+    checkpoint = cache.checkpoint
+    checked = []
+
+    def check(key, summaries, *args, **kwargs):
+        ids = set(cache.open_collection(key).get(include=[])["ids"])
+        missing = [idx for idx, summary in enumerate(summaries) if summary is not None and str(idx) not in ids]
+        checked.append(missing)
+        return checkpoint(key, summaries, *args, **kwargs)
+
+    monkeypatch.setattr(cache, "checkpoint", check)
+    result = ingest.run_pipeline(
+        synthetic_pdf(8), FakeModel(latency=0), {"regions": False, "text_fast_path": False, "batch_size": 2},
+        cache=cache
+    )
+    assert result["failed"] == []
+    assert checked and all(missing == [] for missing in checked)
@@ -0,0 +1,21 @@
+from kv_store import QUERY_CHUNK, KeyValueStore
+
+
+def test_get_many_spans_query_chunks(tmp_path):
+    store = KeyValueStore(str(tmp_path / "kv.db"), "items", "value TEXT")
+    items = {f"key{n}": f"value{n}" for n in range(QUERY_CHUNK * 2 + 1)}
+    store.put_many(items.items())
+    assert len(store) == len(items)
+    assert store.get_many(list(items) + ["missing"]) == items
+    store.put_many([("key0", "replaced")])
+    assert store.get_many(["key0"]) == {"key0": "replaced"}
+    assert len(store) == len(items)
+
+
+def test_trim_keeps_the_most_recently_written(tmp_path):
+    store = KeyValueStore(str(tmp_path / "kv.db"), "items", "value TEXT")
+    store.put_many((f"key{n}", "old") for n in range(10))
+    store.put_many([("key0", "rewritten")])
+    assert store.trim(3) == 7
+    assert store.get_many(f"key{n}" for n in range(10)) == {"key8": "old", "key9": "old", "key0": "rewritten"}
+    assert store.trim(3) == 0
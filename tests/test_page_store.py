@@ -0,0 +1,22 @@
+from page_store import PageStore
+
+
+def test_spilled_reads_keep_one_map(tmp_path):
+    store = PageStore(memory_limit=1000, spill_dir=str(tmp_path))
+    for idx in range(200):
+        data = bytes([idx]) * 500
+        store.put(idx, data)
+        assert store.get(idx) == data
+    assert store.get(0) == bytes([0]) * 500
+    assert len(store._maps) == 1
+    store.close()
+
+
+def test_storing_a_page_again_replaces_it():
+    store = PageStore(memory_limit=1000)
+    store.put(0, b"a" * 400)
+    store.put(0, b"b" * 300)
+    assert store.memory_bytes == 300
+    assert store.get(0) == b"b" * 300
+    store.put(1, b"c" * 700)
+    assert store.memory_bytes == 1000
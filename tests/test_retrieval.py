@@ -0,0 +1,29 @@
+from page_store import PageStore
+from retrieval import pack_pages
+
+HITS = [{"page": 1}, {"page": 2}]
+
+
+def _store():
+    store = PageStore()
+    store.put(0, b"a" * 100)
+    store.put(0, b"a" * 40, variant="index")
+    store.put(1, b"b" * 30)
+    store.put(1, b"b" * 10, variant="index")
+    return store
+
+
+def _sizes(packed):
+    return [(ref, len(part["data"])) for ref, part in packed]
+
+
+def test_pages_fit_at_full_quality():
+    assert _sizes(pack_pages(HITS, _store(), budget=200)) == [(1, 100), (2, 30)]
+
+
+def test_best_page_falls_back_to_its_lighter_variant():
+    assert _sizes(pack_pages(HITS, _store(), budget=50)) == [(1, 40), (2, 10)]
+
+
+def test_best_page_is_forced_through_at_its_smallest():
+    assert _sizes(pack_pages(HITS, _store(), budget=10)) == [(1, 40)]
@@ -0,0 +1,34 @@
+from fake_gemini import FakeModel, FakeResponse
+from retrieval import stream_text
+
+IMAGE = {"mime_type": "image/png", "data": b"page one"}
+
+
+def _model():
+    return FakeModel(latency=0, chunk_latency=0, chunk_words=2, summary_words=12)
+
+
+def test_streamed_text_matches_unstreamed():
+    model = _model()
+    full = model.generate_content(["Answer the question.", IMAGE]).text
+    chunks = list(stream_text(model.generate_content(["Answer the question.", IMAGE], stream=True)))
+    assert len(chunks) > 1
+    assert "".join(chunks) == full
+
+
+class _NoText:
+    """A chunk like Gemini's last one, whose `.text` raises without parts."""
+
+    @property
+    def text(self):
+        raise ValueError("no parts")
+
+
+def test_empty_chunks_are_skipped():
+    model = _model()
+    full = model.generate_content(["Answer the question.", IMAGE]).text
+    stream = list(model.generate_content(["Answer the question.", IMAGE], stream=True))
+    stream = [FakeResponse("")] + stream[:1] + [FakeResponse(""), _NoText()] + stream[1:] + [_NoText()]
+    chunks = list(stream_text(stream))
+    assert all(chunks)
+    assert "".join(chunks) == full
@@ -0,0 +1,42 @@
+from fake_gemini import FakeModel
+from summarizer import summarize_pages
+
+PAGES = [{"mime_type": "image/png", "data": f"page {idx}".encode()} for idx in range(10)]
+
+
+def _expected():
+    model = FakeModel(latency=0)
+    return [model.generate_content(["Summarize.", page]).text for page in PAGES]
+
+
+def test_failed_pages_are_retried():
+    model = FakeModel(latency=0, fail_pages=PAGES[2:4], fail_times=1)
+    summaries, errors = summarize_pages(model, PAGES, concurrency=4, retries=1, backoff=0)
+    assert summaries == _expected()
+    assert errors == {}
+    assert model.calls == len(PAGES) + 2
+
+
+def test_pages_failing_every_retry_are_reported():
+    model = FakeModel(latency=0, fail_pages=PAGES[5:6], fail_times=3)
+    summaries, errors = summarize_pages(model, PAGES, concurrency=4, retries=2, backoff=0)
+    assert summaries[5] is None
+    assert set(errors) == {5}
+    assert [s for idx, s in enumerate(summaries) if idx != 5] == _expected()[:5] + _expected()[6:]
+
+
+def test_batches_cut_requests():
+    model = FakeModel(latency=0)
+    summaries, errors = summarize_pages(model, PAGES, pages_per_request=4)
+    assert summaries == _expected()
+    assert errors == {}
+    assert model.calls == 3
+
+
+def test_unparseable_batches_fall_back_to_single_pages():
+    model = FakeModel(latency=0, bad_batch_rate=1.0)
+    summaries, errors = summarize_pages(model, PAGES, pages_per_request=4)
+    assert summaries == _expected()
+    assert errors == {}
+    # Three garbled batches (of 4, 4 and 2 pages), then every page alone
+    assert model.calls == 3 + len(PAGES)
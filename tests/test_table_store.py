@@ -0,0 +1,79 @@
+import pytest
+
+from table_store import TableStore, is_period, parse_number
+
+
+@pytest.mark.parametrize("text, value", [
+    ("1,200", 1200.0),
+    ("(1,200)", -1200.0),
+    ("-3.5", -3.5),
+    ("−3.5", -3.5),
+    ("$4.2", 4.2),
+    ("€ 12", 12.0),
+    ("+12%", 12.0),
+    ("(4%)", -4.0),
+    ("$4.2M", 4.2),
+    ("1.5bn", 1.5),
+    ("300k", 300.0),
+])
+def test_parse_number(text, value):
+    assert parse_number(text) == value
+
+
+@pytest.mark.parametrize("text", ["", "n/a", "Revenue", "12 months", "4.2x"])
+def test_parse_number_rejects_text(text):
+    assert parse_number(text) is None
+
+
+@pytest.mark.parametrize("text", ["2023", "FY2023", "FY 23", "Q1 2023", "Q1'23", "2023 Q1", "H2 2022"])
+def test_is_period(text):
+    assert is_period(text)
+
+
+@pytest.mark.parametrize("text", ["1,200", "$2023", "12%", "Revenue", "3023"])
+def test_is_period_rejects_values(text):
+    assert not is_period(text)
+
+
+def _store():
+    store = TableStore()
+    store.add_table(3, [
+        ["(in millions)", "2023", "2022"],
+        ["Revenue", "$1,200", "$1,050"],
+        ["Operating margin", "18%", "(2%)"],
+    ])
+    store.add_table(5, [
+        ["Region", "Revenue", "Headcount"],
+        ["Europe", "400", "1,100"],
+        ["Americas", "650", "2,300"],
+    ])
+    store.add_table(7, [
+        ["Segment", "2019 revenue", "2020 revenue"],
+        ["Revenue", "380", "400"],
+    ])
+    return store
+
+
+def test_year_headers_are_answerable():
+    facts = _store().lookup("revenue in 2023")
+    assert [(f["page"], f["row"], f["column"], f["value"]) for f in facts] == [(3, "Revenue", "2023", 1200.0)]
+    assert _store().lookup("operating margin 2022")[0]["value"] == -2.0
+
+
+def test_every_query_term_must_match_a_label():
+    assert _store().lookup("revenue in Asia in 2019") == []
+    assert _store().lookup("explain the revenue trend") == []
+    # Labels that say least beyond the question come first
+    assert _store().lookup("Europe revenue")[0]["row"] == "Europe"
+
+
+def test_numeric_headers_are_skipped():
+    store = TableStore()
+    assert store.add_table(1, [["", "1,200", "3.5"], ["Revenue", "4", "5"]]) == 0
+    assert store.add_table(1, [["Only a header", "2023"]]) == 0
+    assert len(store) == 0 and store.tables == 0
+
+
+def test_round_trip():
+    store = _store()
+    assert TableStore.from_dict(store.to_dict()).lookup("revenue in 2022") == store.lookup("revenue in 2022")
@@ -0,0 +1,62 @@
+import ingest
+from ingest import JobQueue, Worker, credential_id
+from scheduler import RequestScheduler
+
+
+def test_jobs_run_with_their_credentials_scheduler(tmp_path, monkeypatch):
+    used = []
+    monkeypatch.setattr(
+        ingest, "run_pipeline",
+        lambda pdf_bytes, model, settings, scheduler=None, **kwargs: used.append((model, scheduler)) or {
+            "stats": {"pages": 1, "errors": 0}
+        }
+    )
+    queue = JobQueue(str(tmp_path))
+    alice, bob = RequestScheduler(), RequestScheduler()
+    worker = Worker(queue)
+    worker.add_credential(credential_id("alice"), lambda name: "alice-model", alice)
+    worker.add_credential(credential_id("bob"), lambda name: "bob-model", bob)
+    for key in ("alice", "bob"):
+        queue.submit(key.encode(), f"{key}.pdf", credential=credential_id(key))
+        worker.run_job(queue.claim("test", list(worker.credentials)))
+    assert used == [("alice-model", alice), ("bob-model", bob)]
+
+
+def test_claim_routes_jobs_by_credential(tmp_path):
+    queue = JobQueue(str(tmp_path))
+    alice = queue.submit(b"alice", "alice.pdf", credential=credential_id("alice"))
+    shared = queue.submit(b"shared", "shared.pdf")
+    bob = queue.submit(b"bob", "bob.pdf", credential=credential_id("bob"))
+
+    assert queue.claim("none", [], default=False) is None
+    assert queue.claim("bob", [credential_id("bob")], default=False)["id"] == bob
+    assert queue.claim("bob", [credential_id("bob")], default=False) is None
+    assert queue.claim("default", [])["id"] == shared
+    assert queue.claim("default", []) is None
+    assert queue.claim("alice", [credential_id("alice")])["id"] == alice
+
+
+class FailedEntries:
+    def __init__(self, root, vectors=None):
+        self.settings = {"custom": {"model": "custom-model"}, "broken": {"model": "broken-model"}, "plain": None}.get
+
+    def failed_keys(self):
+        return ["custom", "broken", "plain"]
+
+
+def test_retry_sweep_uses_each_entrys_model(tmp_path, monkeypatch):
+    retried = []
+
+    def retry_failed(doc_key, model, cache=None, settings=None, scheduler=None):
+        if doc_key == "broken":
+            raise RuntimeError("model unavailable")
+        retried.append((doc_key, model))
+
+    monkeypatch.setattr(ingest, "IndexCache", FailedEntries)
+    monkeypatch.setattr(ingest, "retry_failed", retry_failed)
+    worker = Worker(JobQueue(str(tmp_path)), model_factory=lambda name: f"model:{name}")
+    worker.retry_failed_pages()
+    assert retried == [
+        ("custom", "model:custom-model"),
+        ("plain", f"model:{ingest.DEFAULT_SETTINGS['model']}"),
+    ]
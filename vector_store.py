@@ -0,0 +1,205 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from embeddings import LocalEmbedding
+from telemetry import span
+
+DEFAULT_BATCH_SIZE = 64
+DEFAULT_STORE_DIR = os.path.join(".index_cache", "chroma")
+
+# Shared collection holding every corpus document's pages, tagged by doc_id
+CORPUS_COLLECTION = "corpus"
+
+# A collection's `last_used` is rewritten at most this often; opening one
+# (every index cache load, e.g. each poll of a background job) is a read
+LAST_USED_SECONDS = 10 * 60
+
+# One client per path per process: Chroma does not support several
+# clients on the same persistent directory in one process.
+_clients = {}
+_clients_lock = threading.Lock()
+_embedder = None
+
+
+def query_embedder():
+    """
+    The process's shared `embeddings.LocalEmbedding`, the one stores
+    created without an explicit `embedding_function` use. Embedding a
+    query once with it lets the vector lookup and the answer cache share
+    the vector.
+    """
+    global _embedder
+    with _clients_lock:
+        if _embedder is None:
+            _embedder = LocalEmbedding()
+        return _embedder
+
+
+def configure_embedder(**options):
+    """
+    Replaces the shared embedder with one built from `options` (batch_size,
+    threads, dtype, cache_dir; see `LocalEmbedding`) unless it already has
+    those settings. An already loaded model is kept. Stores pick the new
+    embedder up with their next collection.
+    """
+    global _embedder
+    with _clients_lock:
+        if _embedder is None or any(getattr(_embedder, name) != value for name, value in options.items()):
+            model = _embedder._model if _embedder is not None else None
+            _embedder = LocalEmbedding(model=model, **options)
+        return _embedder
+
+
+def embed_query(query):
+    embedder = query_embedder()
+    with span("embed_query", bytes=len(query.encode())):
+        return [float(x) for x in embedder([query])[0]]
+
+
+def collection_name(doc_key):
+    return f"doc_{doc_key[:48]}"
+
+
+class VectorStore:
+    """
+    Persistent Chroma store shared by every session (and every process
+    pointed at the same `path`), with one collection per document key.
+
+    Nothing is opened until a collection is first needed, so constructing a
+    store is free at app start-up. Documents searched together also get
+    their rows copied into one `corpus` collection. Collections record when
+    they were last used (to within `LAST_USED_SECONDS`) so `collect` can
+    drop the ones no longer backed by the index cache or idle for longer
+    than `max_age` seconds. They embed with the shared `query_embedder`
+    (Chroma's default model, batched and cached) unless an
+    `embedding_function` is given (e.g. an offline one for benchmarks).
+    """
+
+    def __init__(self, path=DEFAULT_STORE_DIR, embedding_function=None):
+        self.path = path
+        self.embedding_function = embedding_function
+
+    @property
+    def client(self):
+        with _clients_lock:
+            if self.path not in _clients:
+                import chromadb
+
+                _clients[self.path] = chromadb.PersistentClient(path=self.path)
+            return _clients[self.path]
+
+    def collection(self, doc_key, fresh=False):
+        name = collection_name(doc_key)
+        if fresh:
+            self.delete(doc_key)
+        collection = self.client.get_or_create_collection(
+            name, metadata={"doc_key": doc_key}, embedding_function=self.embedding_function or query_embedder()
+        )
+        now = time.time()
+        if now - (collection.metadata or {}).get("last_used", 0) > LAST_USED_SECONDS:
+            collection.modify(metadata={"doc_key": doc_key, "last_used": now})
+        return collection
+
+    def corpus(self):
+        return self.client.get_or_create_collection(
+            CORPUS_COLLECTION, embedding_function=self.embedding_function or query_embedder()
+        )
+
+    def delete(self, doc_key):
+        try:
+            self.client.delete_collection(collection_name(doc_key))
+        except Exception:
+            pass
+        try:
+            self.corpus().delete(where={"doc_id": doc_key})
+        except Exception:
+            pass
+
+    def collect(self, keep=None, max_age=None):
+        """
+        Deletes document collections whose key is not in `keep` (when
+        given) or that have not been used for `max_age` seconds. Returns
+        the number of collections removed.
+        """
+        removed = 0
+        now = time.time()
+        for collection in self.client.list_collections():
+            # Older Chroma versions list Collection objects, newer ones names
+            if isinstance(collection, str):
+                collection = self.client.get_collection(collection)
+            metadata = collection.metadata or {}
+            doc_key = metadata.get("doc_key")
+            if doc_key is None:
+                continue
+            stale = keep is not None and doc_key not in keep
+            if max_age is not None and now - metadata.get("last_used", 0) > max_age:
+                stale = True
+            if stale:
+                self.client.delete_collection(collection.name)
+                removed += 1
+        return removed
+
+
+class BatchWriter:
+    """
+    Buffers pages and writes them to a Chroma collection in bulk.
+
+    Every `batch_size` pages become one `collection.add` call, so one
+    embedding pass and one write serve the whole batch. With `background`
+    the adds run on a single writer thread, so embedding early pages
+    overlaps with summarizing later ones. `flush()` only hands the buffer
+    to that thread; `wait()` also blocks until every write so far has
+    landed, and `close()` does the same and stops the thread.
+    """
+
+    def __init__(self, collection, batch_size=DEFAULT_BATCH_SIZE, background=True):
+        self.collection = collection
+        self.batch_size = max(1, batch_size)
+        self.written = 0
+        self._buffer = []
+        self._futures = []
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=1) if background else None
+
+    def add(self, doc_id, document, metadata):
+        with self._lock:
+            self._buffer.append((str(doc_id), document, metadata))
+            if len(self._buffer) < self.batch_size:
+                return
+            batch, self._buffer = self._buffer, []
+        self._write(batch)
+
+    def flush(self):
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+        if batch:
+            self._write(batch)
+
+    def wait(self):
+        self.flush()
+        with self._lock:
+            futures, self._futures = self._futures, []
+        for future in futures:
+            future.result()
+
+    def _write(self, batch):
+        if self._pool is None:
+            self._add(batch)
+        else:
+            future = self._pool.submit(self._add, batch)
+            with self._lock:
+                self._futures.append(future)
+
+    def _add(self, batch):
+        ids, documents, metadatas = zip(*batch)
+        # Chroma embeds the documents inside `add`, so this span is embed + write
+        with span("embed", pages=len(batch), bytes=sum(len(d.encode()) for d in documents)):
+            self.collection.add(ids=list(ids), documents=list(documents), metadatas=list(metadatas))
+        self.written += len(batch)
+
+    def close(self):
+        self.wait()
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)